@@ -2,6 +2,15 @@
 import os
 import struct
 import csv
+import gzip
+import numpy as np
+
+from .asd_header import AsdHeader
+
+# asd file header size in bytes
+HEAD_SIZE = 484
+# number of bands of the 350-2500nm reflection data
+BANDS = 2151
 
 
 def asd_read(infile):
@@ -13,17 +22,136 @@ def asd_read(infile):
     if not os.path.exists(infile) or not os.path.isfile(infile):
         raise FileNotFoundError("%s not exists or not a file" % str(infile))
 
-    fdata = open(infile, "rb")
-    head = fdata.read(484)
-    if head[:3] != b"ASD":
-        head = _asd_head(head)
-        data = _asd_source_data(fdata)
-    else:
-        data = struct.unpack("2151f", fdata.read())
+    with open(infile, "rb") as fdata:
+        head = fdata.read(HEAD_SIZE)
+        if head[:3] != b"ASD":
+            head = _asd_head(head)
+            data = _asd_source_data(fdata)
+        else:
+            data = struct.unpack("2151f", fdata.read())
 
     return head, data
 
 
+def asd_read_many(infiles, dtype=np.float32):
+    """
+    read a batch of asd binary files into one matrix
+    :param infiles: asd input file names
+    :param dtype: data type of the result matrix, float32 or float64
+    :return: list of file heads and (N, 2151) reflection data matrix
+    """
+    infiles = list(infiles)
+    heads = []
+    data = np.empty((len(infiles), BANDS), dtype=dtype)
+    for row, infile in enumerate(infiles):
+        if not os.path.exists(infile) or not os.path.isfile(infile):
+            raise FileNotFoundError("%s not exists or not a file" % str(infile))
+
+        with open(infile, "rb") as fdata:
+            head = fdata.read(HEAD_SIZE)
+            if head[:3] != b"ASD":
+                heads.append(_asd_head(head))
+                data[row] = _asd_source_data(fdata)
+                continue
+            buf = fdata.read(BANDS * 4)
+        if len(buf) != BANDS * 4:
+            raise ValueError("%s: truncated data section" % str(infile))
+        # copy the float32 data section straight into the matrix row
+        data[row] = np.frombuffer(buf, dtype="<f4")
+        heads.append(head)
+
+    return heads, data
+
+
+class RefMemmap:
+    """
+    lazy (N, 2151) view of reflection files, the data section of each file
+    is memory mapped only when its rows and bands are accessed
+    """
+    def __init__(self, files, skipped=()):
+        """
+        :param files: reflection file names, one row per file
+        :param skipped: files left out because they do not have the fixed
+                        reflection layout
+        """
+        self.files = list(files)
+        self.skipped = list(skipped)
+
+    @property
+    def shape(self):
+        return len(self.files), BANDS
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows, bands = key
+        index = np.arange(len(self.files))[rows]
+        if index.ndim == 0:
+            return self._read(int(index), bands)
+        res = [self._read(int(i), bands) for i in index]
+        if not res:
+            return np.empty((0,) + np.empty(BANDS)[bands].shape, dtype="<f4")
+        return np.stack(res)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+    def _read(self, row, bands):
+        """
+        map one file and copy out the requested bands
+        :param row: file index
+        :param bands: band index or slice
+        :return: copied band values
+        """
+        mm = np.memmap(self.files[row], dtype="<f4", mode="r",
+                       offset=HEAD_SIZE, shape=(BANDS,))
+        try:
+            return np.array(mm[bands])
+        finally:
+            del mm
+
+    def head(self, row):
+        """
+        read the file header of one row
+        :param row: file index
+        :return: file header, 484 bytes
+        """
+        with open(self.files[row], "rb") as fdata:
+            return fdata.read(HEAD_SIZE)
+
+
+def asd_memmap(path):
+    """
+    memory map a reflection file or all reflection files in a directory
+    :param path: reflection file name or directory
+    :return: RefMemmap, lazy (N, 2151) view of the reflection data, files of
+             a directory without the fixed reflection layout are listed in
+             its skipped attribute, raise ValueError for a single such file
+    """
+    # only files with the fixed reflection layout can be mapped
+    size = HEAD_SIZE + BANDS * 4
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        files = [os.path.join(path, name) for name in names]
+        files = [ff for ff in files if os.path.isfile(ff)]
+    elif os.path.isfile(path):
+        if os.path.getsize(path) != size:
+            raise ValueError("%s is not a %d bytes reflection file" % (
+                str(path), size))
+        files = [path]
+    else:
+        raise FileNotFoundError("%s not exists" % str(path))
+    mapped = []
+    skipped = []
+    for ff in files:
+        (mapped if os.path.getsize(ff) == size else skipped).append(ff)
+    return RefMemmap(mapped, skipped)
+
+
 def _asd_head(header):
     """
     modify asd source file header to reflection mode
@@ -31,14 +159,7 @@ def _asd_head(header):
     :return modified asd file header
     """
     # replace data type to reflection
-    h1 = list(struct.unpack('484b', header))
-    h1[0] = ord('A')
-    h1[1] = ord('S')
-    h1[2] = ord('D')
-    h1[179] = 16
-    h1[199] = 0
-    header = struct.pack('484b', *h1)
-    return header
+    return bytes(AsdHeader(header).to_reflection())
 
 
 def _asd_source_data(data_section):
@@ -47,16 +168,23 @@ def _asd_source_data(data_section):
     :param data_section: input binary data without head section
     :return: reflection data
     """
-    ref1 = struct.unpack('2151d', data_section.read(17208))
-    data_section.read(18)
-    cur = data_section.tell()
-    ref2 = []
-    for i in range(1, 30):
-        data_section.seek(cur + i)
-        ref2 = struct.unpack('2151d', data_section.read(17208))
-        if 0 < abs(max(ref2)) < 1e10 and 0 < abs(min(ref2)) < 1e10:
-            break
-    return [ref1[i] / ref2[i] for i in range(2151)]
+    block = BANDS * 8
+    # the white reference starts 18 bytes after the raw data block, at an
+    # unknown byte offset between 1 and 29, read everything at once
+    start = block + 18
+    buf = data_section.read(start + 29 + block)
+    count = min(29, len(buf) - start - block)
+    if count < 1:
+        raise ValueError("truncated asd source data")
+    ref1 = np.frombuffer(buf, dtype="<f8", count=BANDS)
+    # one row per candidate byte offset, all views on the same buffer
+    ref2 = np.ndarray((count, BANDS), dtype="<f8", buffer=buf,
+                      offset=start + 1, strides=(1, 8))
+    vmax = np.abs(ref2.max(axis=1))
+    vmin = np.abs(ref2.min(axis=1))
+    valid = (0 < vmax) & (vmax < 1e10) & (0 < vmin) & (vmin < 1e10)
+    row = int(np.argmax(valid)) if valid.any() else count - 1
+    return ref1 / ref2[row]
 
 
 def asd_write(out_file_name, head, data):
@@ -67,16 +195,61 @@ def asd_write(out_file_name, head, data):
     :param data: reflection data
     :return: if success, return 0, else raise IOError
     """
+    asd_write_many([out_file_name], [head], [data])
+    return 0
+
+
+def asd_write_many(out_file_names, heads, data, fsync_every=None):
+    """
+    write a batch of asd reflection binary files, the data of each file is
+    written straight from the buffer of the data matrix
+    :param out_file_names: the output file names, ".ref" is appended if
+                           missing
+    :param heads: file headers
+    :param data: (N, 2151) reflection data
+    :param fsync_every: if given, flush written files to disk every
+                        fsync_every files
+    :return: written file names, raise IOError if failed
+    """
+    data = np.ascontiguousarray(data, dtype="<f4").reshape(-1, BANDS)
+    if not len(out_file_names) == len(heads) == len(data):
+        raise ValueError("file names, heads and data length not match")
+    row = BANDS * 4
+    buf = memoryview(data.reshape(-1)).cast("B")
+    written = []
+    unsynced = []
     try:
-        if not ".ref" not in out_file_name:
-            out_file_name += ".ref"
-        out = open(out_file_name, 'wb')
-        out.write(head)
-        out.write(struct.pack('2151f', *data))
-        out.close()
+        for i, out_file_name in enumerate(out_file_names):
+            if not os.path.basename(out_file_name).lower().endswith(".ref"):
+                out_file_name += ".ref"
+            with open(out_file_name, "wb") as out:
+                out.write(bytes(heads[i]))
+                out.write(buf[i * row:(i + 1) * row])
+            written.append(out_file_name)
+            if fsync_every:
+                unsynced.append(out_file_name)
+                if len(unsynced) >= fsync_every:
+                    _fsync_files(unsynced)
+                    unsynced = []
+        _fsync_files(unsynced)
     except IOError:
         raise IOError("Can not write file")
-    return 0
+    return written
+
+
+def _fsync_files(file_names):
+    """
+    flush written files to disk
+    :param file_names: file names
+    :return: no return
+    """
+    for file_name in file_names:
+        # fsync on windows (FlushFileBuffers) needs write access
+        fd = os.open(file_name, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
 
 def asd_write_csv(data, output_file, header=None, start=350):
@@ -102,3 +275,54 @@ def asd_write_csv(data, output_file, header=None, start=350):
         for row in zip(bands, data):
             writer.writerow(row)
     return 0
+
+
+def asd_write_csv_many(data, output_file, names=None, start=350,
+                       fmt="%.6f", chunk=256, compress=None):
+    """
+    save many spectra to one wide csv file, one row per band and one column
+    per spectrum:
+        bands, s1, s2, ...
+        350, 0.111, 0.112, ...
+    :param data: (N, bands) reflection data, array or lazy view
+    :param output_file: output csv file name, ".csv" is added if missing
+                        and ".gz" is kept only for compressed files
+    :param names: spectrum names of the csv header, default s1, s2, ...
+    :param start: start band
+    :param fmt: float format of the reflection values
+    :param chunk: bands written per block
+    :param compress: if True write gzip file, None to decide by the
+                     ".gz" suffix of the output file name
+    :return: 0 if success
+    """
+    name = output_file.lower()
+    if compress is None:
+        compress = name.endswith(".gz")
+    if name.endswith(".gz"):
+        output_file, name = output_file[:-3], name[:-3]
+    # out -> out.csv, out.gz -> out.csv.gz, the .gz suffix follows compress
+    if not name.endswith(".csv"):
+        output_file += ".csv"
+    if compress:
+        output_file += ".gz"
+
+    rows, length = data.shape
+    if names is None:
+        names = ["s%d" % (i + 1) for i in range(rows)]
+    if len(names) != rows:
+        raise ValueError("names and data length not match")
+    bands = np.arange(start, start + length)
+    row_fmt = ["%d"] + [fmt] * rows
+
+    if compress:
+        text = gzip.open(output_file, "wt", newline="")
+    else:
+        text = open(output_file, "w", newline="")
+    with text:
+        writer = csv.writer(text)
+        writer.writerow(["bands"] + list(names))
+        for i in range(0, length, chunk):
+            block = np.asarray(data[:, i:i + chunk], dtype=np.float64)
+            block = np.column_stack((bands[i:i + chunk], block.T))
+            np.savetxt(text, block, fmt=row_fmt, delimiter=",")
+    return 0
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+ASD文件头
+"""
+import struct
+import datetime
+
+
+# name: (struct format, byte offset) of the 484 bytes asd file header
+_FIELDS = {
+    "co": ("3s", 0),
+    "comments": ("157s", 3),
+    "when": ("<9h", 160),
+    "program_version": ("B", 178),
+    "file_version": ("B", 179),
+    "itime": ("B", 180),
+    "dc_corr": ("B", 181),
+    "dc_time": ("<l", 182),
+    "data_type": ("B", 186),
+    "ref_time": ("<l", 187),
+    "ch1_wavel": ("<f", 191),
+    "wavel_step": ("<f", 195),
+    "data_format": ("B", 199),
+    "old_dc_count": ("B", 200),
+    "old_ref_count": ("B", 201),
+    "old_sample_count": ("B", 202),
+    "application": ("B", 203),
+    "channels": ("<H", 204),
+    "app_data": ("128s", 206),
+    "gps_data": ("56s", 334),
+    "gps_heading": ("<d", 334),
+    "gps_speed": ("<d", 342),
+    "gps_latitude": ("<d", 350),
+    "gps_longitude": ("<d", 358),
+    "gps_altitude": ("<d", 366),
+    "integration_time": ("<L", 390),
+    "fo": ("<h", 394),
+    "dcc": ("<h", 396),
+    "calibration": ("<H", 398),
+    "instrument_num": ("<H", 400),
+    "ymin": ("<f", 402),
+    "ymax": ("<f", 406),
+    "xmin": ("<f", 410),
+    "xmax": ("<f", 414),
+    "ip_numbits": ("<H", 418),
+    "xmode": ("B", 420),
+    "flags": ("4s", 421),
+    "dc_count": ("<H", 425),
+    "ref_count": ("<H", 427),
+    "sample_count": ("<H", 429),
+    "instrument": ("B", 431),
+    "bulb": ("<L", 432),
+    "swir1_gain": ("<H", 436),
+    "swir2_gain": ("<H", 438),
+    "swir1_offset": ("<H", 440),
+    "swir2_offset": ("<H", 442),
+    "splice1_wavelength": ("<f", 444),
+    "splice2_wavelength": ("<f", 448),
+    "smart_detector_type": ("27s", 452),
+    "spare": ("5s", 479),
+}
+
+
+class _Field:
+    """
+    header field, decoded from and patched into the header buffer on access
+    """
+    __slots__ = ("fmt", "offset")
+
+    def __init__(self, fmt, offset):
+        self.fmt = struct.Struct(fmt)
+        self.offset = offset
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = self.fmt.unpack_from(obj.buffer, self.offset)
+        return value[0] if len(value) == 1 else value
+
+    def __set__(self, obj, value):
+        if not isinstance(value, (tuple, list)):
+            value = (value,)
+        self.fmt.pack_into(obj.buffer, self.offset, *value)
+
+
+class AsdHeader:
+    """
+    asd file header, 484 bytes. Fields are decoded only when they are
+    accessed and patched in place when they are assigned
+    """
+    __slots__ = ("buffer",)
+    size = 484
+
+    def __init__(self, head=None):
+        """
+        :param head: header bytes, if None an empty header is created
+        """
+        if head is None:
+            head = bytes(self.size)
+        if len(head) != self.size:
+            raise ValueError("asd file header must be %d bytes" % self.size)
+        self.buffer = bytearray(head)
+
+    def __bytes__(self):
+        return bytes(self.buffer)
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        if isinstance(other, AsdHeader):
+            other = other.buffer
+        return self.buffer == other
+
+    def __repr__(self):
+        return "AsdHeader(co=%r, data_type=%d, instrument_num=%d)" % (
+            self.co, self.data_type, self.instrument_num)
+
+    @property
+    def acquisition_time(self):
+        """
+        spectrum saved time, None if the header time is invalid
+        """
+        sec, minute, hour, mday, mon, year = self.when[:6]
+        try:
+            return datetime.datetime(year + 1900, mon + 1, mday,
+                                     hour, minute, sec)
+        except ValueError:
+            return None
+
+    def to_reflection(self):
+        """
+        modify asd source file header to reflection mode, in place
+        :return: the header itself
+        """
+        self.buffer[0:3] = b"ASD"
+        self.buffer[179] = 16
+        self.buffer[199] = 0
+        return self
+
+
+for _name, (_fmt, _offset) in _FIELDS.items():
+    setattr(AsdHeader, _name, _Field(_fmt, _offset))
+del _name, _fmt, _offset
@@ -0,0 +1,224 @@
+# coding=utf-8
+"""
+光谱文件解析结果缓存
+"""
+import os
+import time
+import sqlite3
+import numpy as np
+
+from .asd import asd_read, BANDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spectra (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    head BLOB NOT NULL,
+    dtype TEXT NOT NULL,
+    data BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    atime REAL NOT NULL
+)
+"""
+
+
+class SpectrumCache:
+    """
+    on disk cache of decoded asd files keyed by (path, size, mtime), backed
+    by sqlite so that several processes can share one cache file
+    """
+    def __init__(self, filename, max_size=512 * 1024 ** 2, timeout=30):
+        """
+        :param filename: cache file name
+        :param max_size: max bytes of cached data, least recently used
+                         entries are evicted beyond it, None for no limit
+        :param timeout: seconds to wait for a lock held by another process
+        """
+        dirname = os.path.dirname(os.path.abspath(filename))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.filename = filename
+        self.max_size = max_size
+        self._conn = sqlite3.connect(filename, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS spectra_atime "
+                               "ON spectra (atime)")
+        # running bytes of cached data, summed once instead of on every read
+        self._total = self._sum()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _key(infile):
+        """
+        :param infile: asd file name
+        :return: absolute path, size and mtime of the file
+        """
+        if not os.path.exists(infile) or not os.path.isfile(infile):
+            raise FileNotFoundError("%s not exists or not a file" % str(infile))
+        st = os.stat(infile)
+        return os.path.abspath(infile), st.st_size, st.st_mtime_ns
+
+    def read(self, infile):
+        """
+        read asd binary file through the cache
+        :param infile: asd input file name
+        :return: file head and reflection data
+        """
+        heads, data = self.read_many([infile])
+        return heads[0], data[0]
+
+    def read_many(self, infiles):
+        """
+        read a batch of asd binary files through the cache, files not cached
+        or changed on disk are decoded and stored
+        cache hits are looked up without a write lock, misses are decoded
+        outside any transaction and stored in one short write transaction,
+        so other processes sharing the cache are not blocked by decoding
+        :param infiles: asd input file names
+        :return: list of file heads and (N, 2151) reflection data matrix
+        """
+        keys = [self._key(infile) for infile in infiles]
+        heads = [None] * len(keys)
+        data = np.empty((len(keys), BANDS), dtype=np.float64)
+        now = time.time()
+        hits = []
+        misses = []
+        # read only lookup, a select does not open a write transaction
+        for row, (path, size, mtime) in enumerate(keys):
+            hit = self._conn.execute(
+                "SELECT head, dtype, data FROM spectra "
+                "WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime)).fetchone()
+            if hit is None:
+                misses.append(row)
+                continue
+            head, dtype, buf = hit
+            heads[row] = bytes(head)
+            data[row] = np.frombuffer(buf, dtype=dtype)
+            hits.append((now, path))
+
+        # decode misses with no transaction open
+        entries = []
+        for row in misses:
+            path, size, mtime = keys[row]
+            head, values = asd_read(path)
+            # asd reflection files hold float32, raw conversions are kept
+            # in full precision
+            dtype = "<f4" if isinstance(values, tuple) else "<f8"
+            buf = np.asarray(values, dtype=dtype).tobytes()
+            heads[row] = bytes(head)
+            data[row] = values
+            entries.append((path, size, mtime, heads[row], dtype, buf,
+                            len(head) + len(buf), now))
+
+        if entries:
+            self._write(self._insert, entries)
+        if hits:
+            self._write(self._conn.executemany,
+                        "UPDATE spectra SET atime = ? WHERE path = ?", hits)
+        return heads, data
+
+    def _write(self, func, *args):
+        """
+        run a short write transaction, the cache is only an accelerator, so
+        a database locked by another process past the timeout is skipped
+        instead of failing the read
+        :return: True if written
+        """
+        total = self._total
+        try:
+            with self._conn:
+                func(*args)
+        except sqlite3.OperationalError as e:
+            # rolled back, the running total is restored with it
+            self._total = total
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            return False
+        return True
+
+    def _insert(self, entries):
+        """
+        store decoded files and evict beyond the size limit, run inside a
+        write transaction
+        :param entries: rows of the spectra table
+        """
+        total = self._total
+        for entry in entries:
+            stale = self._conn.execute(
+                "SELECT nbytes FROM spectra WHERE path = ?",
+                (entry[0],)).fetchone()
+            if stale is not None:
+                total -= stale[0]
+            self._conn.execute("INSERT OR REPLACE INTO spectra VALUES "
+                               "(?, ?, ?, ?, ?, ?, ?, ?)", entry)
+            total += entry[6]
+        self._total = total
+        # only inserts can grow the cache beyond its limit
+        self._evict()
+
+    def _sum(self):
+        """
+        :return: bytes of cached data in the cache file
+        """
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM spectra").fetchone()[0]
+
+    def _evict(self):
+        """
+        delete least recently used entries beyond the size limit
+        """
+        if self.max_size is None or self._total <= self.max_size:
+            return
+        # other processes may share the cache file, recount before evicting
+        total = self._sum()
+        if total <= self.max_size:
+            self._total = total
+            return
+        rows = self._conn.execute(
+            "SELECT path, nbytes FROM spectra ORDER BY atime")
+        stale = []
+        for path, nbytes in rows:
+            if total <= self.max_size:
+                break
+            stale.append((path,))
+            total -= nbytes
+        self._conn.executemany("DELETE FROM spectra WHERE path = ?", stale)
+        self._total = total
+
+    def invalidate(self, infiles=None):
+        """
+        remove cached entries
+        :param infiles: file names to remove, remove all entries if None
+        :return: no return
+        """
+        with self._conn:
+            if infiles is None:
+                self._conn.execute("DELETE FROM spectra")
+            else:
+                self._conn.executemany(
+                    "DELETE FROM spectra WHERE path = ?",
+                    [(os.path.abspath(infile),) for infile in infiles])
+            self._total = self._sum()
+
+    def size(self):
+        """
+        :return: number of cached files and bytes of cached data
+        """
+        return self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM spectra"
+        ).fetchone()
+
+    def close(self):
+        """
+        close the cache file
+        """
+        self._conn.close()
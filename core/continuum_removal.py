@@ -1,53 +1,56 @@
 # coding=utf-8
-import math
+import numpy as np
+
+from .water_remove import water_remove
+from .parallel import parallel_map
+
+# 计算连续统节点前批量去除非节点的最大次数
+_PRUNE_PASSES = 8
+
+
+def _upper_hull(x, y):
+    """
+    monotone chain upper hull, points on a hull edge are kept as nodes
+    @param x 递增的波段索引
+    @param y 对应的反射率
+    @return 节点在x中的序号
+    """
+    hull = []
+    for c in range(len(x)):
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            # b在a, c连线下方时不是节点
+            temp = (y[b] - y[a]) * (x[c] - x[a]) / (x[b] - x[a]) + y[a]
+            if temp < y[c]:
+                hull.pop()
+            else:
+                break
+        hull.append(c)
+    return hull
 
 
 def continuum_points(data):
     """"
-    连续统去除节点
+    连续统去除节点, nan波段不参与计算
     @param data 平滑去水吸收波段的数据
     @return 连续统节点序列
     """
-    # 节点
-    p = []
-    i = 0
-    length = len(data)
-    # 最后一个数据的索引
-    last = length - 1
-
-    while i < length:
-        if i == 0:
-            p.append(i)
-        if i == last:
-            if not math.isnan(data[i]):
-                p.append(i)
-            return p
-        j = i + 1
-        while j < length:
-            if j == last:
-                if not math.isnan(data[j]):
-                    p.append(j)
-                return p
-            # 如果反射率为nan，继续
-            if math.isnan(data[j]):
-                j += 1
-                continue
-            m = j + 1
-            while m < length:
-                temp = (data[j] - data[i]) * (m - i) / (j - i) + data[i]
-                # 如果存在交点，j往前移动
-                if temp < data[m]:
-                    j += 1
-                    break
-                # 如果遍历了所有的点，j是包络节点
-                if m == last:
-                    i = j
-                    j += 1
-                    p.append(i)
-                    break
-                m += 1
-        # 如果所有点都遍历了，退出循环
-    return p
+    data = np.asarray(data, dtype=np.float64)
+    x = np.flatnonzero(~np.isnan(data))
+    y = data[x]
+    # 严格位于相邻两点连线下方的点不可能是节点, 先批量去除
+    for i in range(_PRUNE_PASSES):
+        if len(x) < 3:
+            break
+        temp = (y[2:] - y[:-2]) * (x[1:-1] - x[:-2]) / (x[2:] - x[:-2]) + \
+            y[:-2]
+        below = np.zeros(len(x), dtype=bool)
+        below[1:-1] = y[1:-1] < temp
+        if not below.any():
+            break
+        x, y = x[~below], y[~below]
+    x = x.tolist()
+    return [x[i] for i in _upper_hull(x, y.tolist())]
 
 
 def continuum_line(data, points):
@@ -55,20 +58,15 @@ def continuum_line(data, points):
     generate continuum line
     :param data: reflection data
     :param  points: continuum nodes
-    :return continuum line points
+    :return continuum line points, nan outside the first and last nodes
     """
-    num = len(points)
-    length = len(data)
-    # initial line
-    line = [float('nan') for i in range(length)]
-
-    for i in range(1, num):
-        start = points[i - 1]
-        end = points[i]
-        for j in range(start, end + 1):
-            temp = (data[end] - data[start]) * (j - start) / (end - start) + data[start]
-            line[j] = round(temp, 7)
-
+    data = np.asarray(data, dtype=np.float64)
+    line = np.full(len(data), np.nan)
+    if len(points) < 2:
+        return line
+    points = np.asarray(points)
+    bands = np.arange(points[0], points[-1] + 1)
+    line[bands] = np.round(np.interp(bands, points, data[points]), 7)
     return line
 
 
@@ -79,23 +77,55 @@ def continuum_removal(data, line):
     :param data: reflection data
     :return continuum removal data
     """
-    length = len(data)
-    # initial data
-    removal = [float('nan') for i in range(length)]
-
-    for i in range(length):
-        if not math.isnan(data[i]):
-            removal[i] = round(data[i] / line[i], 7)
-
-    return removal
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.round(np.divide(data, line), 7)
 
 
-def continuum(data):
+def continuum(data, windows=None):
     """
     calculate continuum removal data
     :param data: the spectrum data
+    :param windows: if given, water absorb windows removed before
+                    calculating the continuum, e.g. WATER_BANDS
     :return continuum removal data
     """
+    if windows is not None:
+        data = water_remove(data, windows)
+    data = np.asarray(data, dtype=np.float64)
     points = continuum_points(data)
     lines = continuum_line(data, points)
     return continuum_removal(data, lines)
+
+
+def _continuum_chunk(data):
+    """
+    continuum removal of a (n, bands) chunk
+    """
+    return np.array([continuum(row) for row in data]).reshape(data.shape)
+
+
+def continuum_many(data, windows=None, workers=1, chunk=256):
+    """
+    continuum removal of a batch of spectra
+    :param data: (N, bands) reflection data
+    :param windows: if given, water absorb windows removed before
+                    calculating the continuum, e.g. WATER_BANDS
+    :param workers: number of worker processes, None for cpu count, 1 to
+                    run in the current process
+    :param chunk: spectra sent to a worker at once
+    :return (N, bands) continuum removal data
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    if windows is not None:
+        data = water_remove(data, windows)
+    blocks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+    res = np.empty(data.shape)
+    start = 0
+    for job in parallel_map(_continuum_chunk, blocks, workers, chunksize=1):
+        if job.error is not None:
+            raise ValueError(job.error)
+        res[start:start + len(job.item)] = job.result
+        start += len(job.item)
+    return res
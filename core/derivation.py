@@ -2,6 +2,52 @@
 """
 计算光谱微分
 """
+from math import comb
+import numpy as np
+
+
+def derivative(data, order=1, gap=1, segment=1, out=None):
+    """
+    批量计算光谱微分, 沿最后一维对(N, bands)数组计算, 间隔为gap的中心差分
+    重复order次, 即
+    der[i] = Σ (-1)^m C(order, m) data[i + gap * (order - 2m)] / (2gap)^order
+    两端order * gap个波段为nan
+    @param data 光谱数据, 一条光谱或(N, bands)数组
+    @param order 微分阶数
+    @param gap 差分间隔(Norris gap)
+    @param segment 差分前的滑动平均窗口(Norris segment), 必须为奇数,
+           两端各segment // 2个波段另外置为nan
+    @param out 输出数组, 可以是data本身
+    @return 光谱的order阶微分
+    """
+    if order < 0 or gap < 1 or segment < 1 or segment % 2 != 1:
+        raise ValueError("order必须不小于0, gap不小于1, segment为正奇数")
+    data = np.asarray(data, dtype=np.float64)
+    length = data.shape[-1]
+    if segment > 1:
+        half = segment // 2
+        smooth = np.full(data.shape, np.nan)
+        if length >= segment:
+            windows = np.lib.stride_tricks.sliding_window_view(
+                data, segment, axis=-1)
+            smooth[..., half:length - half] = windows.mean(axis=-1)
+        data = smooth
+    if out is None:
+        out = np.empty(data.shape)
+
+    reach = order * gap
+    count = max(length - 2 * reach, 0)
+    # compute every term before writing, out may be data itself
+    der = np.zeros(data.shape[:-1] + (count,))
+    if count:
+        for m in range(order + 1):
+            start = reach + gap * (order - 2 * m)
+            der += (-1) ** m * comb(order, m) * data[..., start:start + count]
+        der /= (2 * gap) ** order
+    out[..., reach:reach + count] = der
+    out[..., :min(reach, length)] = np.nan
+    out[..., reach + count:] = np.nan
+    return out
 
 
 def derivation1(data):
@@ -10,17 +56,7 @@ def derivation1(data):
     @param data 光谱数据
     @return data 光谱的一阶微分
     """
-
-    # 初始化数据
-    length = len(data)
-    der = [float('nan') for i in range(length)]
-
-    last = length - 1
-
-    for i in range(1, last):
-        der[i] = (data[i + 1] - data[i - 1]) / 2
-
-    return der
+    return derivative(data, 1)
 
 
 def derivation2(data):
@@ -29,16 +65,7 @@ def derivation2(data):
     @param data 光谱数据
     @return 光谱二阶微分数据
     """
-
-    length = len(data)
-    der = [float('nan') for i in range(length)]
-
-    last = length - 2
-
-    for i in range(2, last):
-        der[i] = (data[i + 2] - 2 * data[i] + data[i - 2]) / 4
-
-    return der
+    return derivative(data, 2)
 
 
 def derivation3(data):
@@ -47,13 +74,4 @@ def derivation3(data):
     @param data 光谱数据
     @return 光谱三阶微分数据
     """
-
-    length = len(data)
-    der = [float('nan') for i in range(length)]
-
-    last = length - 3
-
-    for i in range(3, last):
-        der[i] = (data[i + 3] - 3 * data[i + 1] + 3 * data[i - 1] - data[i - 3]) / 8
-
-    return der
+    return derivative(data, 3)
@@ -0,0 +1,84 @@
+# coding=utf-8
+"""
+特征依赖图, 按需计算特征及其共享的中间结果
+"""
+from collections import OrderedDict
+
+
+class FeatureGraph:
+    """
+    registry of features and intermediates with their dependencies, a
+    requested subset is computed with every shared node computed once
+    """
+    def __init__(self, inputs=("data", "grid")):
+        """
+        :param inputs: names of the input nodes given to compute
+        """
+        self.inputs = tuple(inputs)
+        self.nodes = OrderedDict()
+
+    def add(self, name, deps, func):
+        """
+        register a node
+        :param name: node name
+        :param deps: names of the nodes whose values are passed to func
+        :param func: callable(*dep values) returning the node value
+        :return: func
+        """
+        if name in self.nodes or name in self.inputs:
+            raise ValueError("duplicate node: %s" % name)
+        for dep in deps:
+            if dep not in self.nodes and dep not in self.inputs:
+                raise ValueError("%s depends on unknown node %s" % (name, dep))
+        self.nodes[name] = (tuple(deps), func)
+        return func
+
+    def node(self, name, *deps):
+        """
+        decorator to register a node
+        :param name: node name
+        :param deps: names of the dependent nodes
+        """
+        def wrapper(func):
+            return self.add(name, deps, func)
+        return wrapper
+
+    def plan(self, names):
+        """
+        nodes needed to compute the requested nodes, in dependency order
+        :param names: requested node names
+        :return: list of node names
+        """
+        order = []
+        seen = set(self.inputs)
+
+        def visit(name):
+            if name in seen:
+                return
+            if name not in self.nodes:
+                raise KeyError("unknown feature: %s" % name)
+            for dep in self.nodes[name][0]:
+                visit(dep)
+            seen.add(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def compute(self, names, **inputs):
+        """
+        compute the requested nodes
+        :param names: requested node names
+        :param inputs: values of the input nodes
+        :return: (dict of requested name: value, list of computed nodes)
+        """
+        missing = set(self.inputs) - set(inputs)
+        if missing:
+            raise ValueError("missing inputs: %s" % ", ".join(sorted(missing)))
+        values = dict(inputs)
+        computed = self.plan(names)
+        for name in computed:
+            deps, func = self.nodes[name]
+            values[name] = func(*[values[dep] for dep in deps])
+        return OrderedDict((name, values[name]) for name in names), computed
@@ -0,0 +1,241 @@
+# coding=utf-8
+"""
+自定义光谱指数表达式, 如 "(R831-R667)/(R831+R667)"
+
+R831为831nm波段的反射率, R960:990为960-990nm(包含两端)的平均反射率,
+支持数字, 括号, + - * / ** 及正负号, **的指数须为不超过MAX_EXPONENT的数字
+"""
+import re
+import ast
+import functools
+from collections import OrderedDict
+import numpy as np
+
+from .wavelength import FIELDSPEC
+from .window_stats import WindowStats
+
+_TERM = re.compile(r"[Rr](\d+(?:\.\d+)?)(?:\s*:\s*(\d+(?:\.\d+)?))?")
+_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_UNARYOPS = (ast.UAdd, ast.USub)
+# largest absolute exponent allowed after **
+MAX_EXPONENT = 100
+
+
+def _term_name(start, end=None):
+    """
+    python name of a band or window term
+    """
+    name = "b_%s" % start if end is None else "w_%s_%s" % (start, end)
+    return name.replace(".", "p")
+
+
+def _check(node, expr):
+    """
+    only arithmetic on numbers and band terms is allowed
+    """
+    if isinstance(node, ast.Expression):
+        _check(node.body, expr)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, _BINOPS):
+        if isinstance(node.op, ast.Pow):
+            _check_exponent(node.right, expr)
+        _check(node.left, expr)
+        _check(node.right, expr)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, _UNARYOPS):
+        _check(node.operand, expr)
+    elif isinstance(node, ast.Constant) and \
+            isinstance(node.value, (int, float)):
+        pass
+    elif isinstance(node, ast.Name) and node.id.startswith(("b_", "w_")):
+        pass
+    else:
+        raise ValueError("unsupported syntax in index expression: %s" % expr)
+
+
+def _check_exponent(node, expr):
+    """
+    the exponent of ** must be a bounded number, e.g. R800**2 or R800**-0.5
+    """
+    value = node
+    if isinstance(value, ast.UnaryOp) and isinstance(value.op, _UNARYOPS):
+        value = value.operand
+    if not isinstance(value, ast.Constant) or \
+            not isinstance(value.value, (int, float)) or \
+            abs(value.value) > MAX_EXPONENT:
+        raise ValueError("exponent must be a number within +-%d in index "
+                         "expression: %s" % (MAX_EXPONENT, expr))
+
+
+class _FloatConstants(ast.NodeTransformer):
+    """
+    evaluate number literals as floats, constant parts of an expression
+    then overflow to an error instead of building huge integers
+    """
+    def visit_Constant(self, node):
+        if isinstance(node.value, int):
+            return ast.copy_location(ast.Constant(float(node.value)), node)
+        return node
+
+
+class IndexExpression:
+    """
+    an index expression parsed once and compiled into a vectorized evaluator
+    """
+    def __init__(self, expr):
+        """
+        :param expr: expression, e.g. "(R831-R667)/(R831+R667)"
+        """
+        self.expr = expr
+        terms = OrderedDict()
+
+        def replace(match):
+            start = float(match.group(1))
+            end = None if match.group(2) is None else float(match.group(2))
+            if end is not None and end < start:
+                raise ValueError("window end before start in %s" % expr)
+            name = _term_name(match.group(1), match.group(2))
+            terms[name] = start if end is None else (start, end)
+            return name
+
+        source = _TERM.sub(replace, expr)
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError:
+            raise ValueError("invalid index expression: %s" % expr)
+        _check(tree, expr)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id not in terms:
+                raise ValueError("invalid index expression: %s" % expr)
+        if not terms:
+            raise ValueError("index expression without bands: %s" % expr)
+        # term name: wavelength, or (start, end) window
+        self.terms = terms
+        tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+        self._code = compile(tree, "<index %s>" % expr, "eval")
+
+    def __repr__(self):
+        return "IndexExpression(%r)" % self.expr
+
+    def evaluate(self, columns):
+        """
+        evaluate on precomputed term columns
+        :param columns: dict of term name: (N, ) column
+        :return: (N, ) index values
+        """
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            try:
+                return eval(self._code, {"__builtins__": {}}, columns)
+            except OverflowError:
+                raise ValueError("overflow in index expression: %s" %
+                                 self.expr)
+
+    def __call__(self, data, grid=FIELDSPEC):
+        """
+        :param data: (N, bands) spectral data, or one spectrum
+        :param grid: wavelength grid
+        :return: index values, a float for one spectrum
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim == 1:
+            return float(self(data.reshape(1, -1), grid)[0])
+        res = self.evaluate(_columns(data, self.terms, grid))
+        return np.broadcast_to(res, (len(data),)).astype(np.float64)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_index(expr):
+    """
+    parse and compile an index expression, cached by the expression text
+    :param expr: expression, e.g. "2*R960:990/(R920:940+R1090:1110)"
+    :return: IndexExpression
+    """
+    return IndexExpression(expr)
+
+
+def _columns(data, terms, grid):
+    """
+    reflection columns and window means of the terms
+    :param data: (N, bands) spectral data
+    :param terms: dict of term name: wavelength or (start, end) window
+    :param grid: wavelength grid
+    :return: dict of term name: (N, ) column
+    """
+    columns = {}
+    windows = {}
+    for name, term in terms.items():
+        if isinstance(term, tuple):
+            # window() clips to the grid, both ends must be covered
+            grid.index(term[0])
+            grid.index(term[1])
+            sl = grid.window(term[0], term[1], closed=True)
+            if sl.stop <= sl.start:
+                raise ValueError("window %g-%gnm has no band in %r" % (
+                    term[0], term[1], grid))
+            windows[name] = sl
+        else:
+            columns[name] = data[:, grid.index(term)]
+    if windows:
+        # one prefix sum over the bands covering all windows
+        span = slice(min(sl.start for sl in windows.values()),
+                     max(sl.stop for sl in windows.values()))
+        stats = WindowStats(data, span, squares=False)
+        for name, sl in windows.items():
+            columns[name] = stats.mean(sl)
+    return columns
+
+
+def evaluate_indices(data, indices, grid=FIELDSPEC, chunk=4096):
+    """
+    evaluate several index expressions on a batch of spectra, band columns
+    and window means shared by the expressions are computed once per chunk
+    :param data: (N, bands) spectral data, or one spectrum
+    :param indices: dict of index name: expression text or IndexExpression
+    :param grid: wavelength grid
+    :param chunk: number of spectra computed at a time
+    :return: structured array with one field per index, one row per spectrum
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    exprs = OrderedDict()
+    terms = OrderedDict()
+    for name, expr in indices.items():
+        if not isinstance(expr, IndexExpression):
+            expr = compile_index(expr)
+        exprs[name] = expr
+        terms.update(expr.terms)
+    table = np.empty(len(data), dtype=[(name, np.float64) for name in exprs])
+    for i in range(0, len(data), chunk):
+        block = np.asarray(data[i:i + chunk], dtype=np.float64)
+        columns = _columns(block, terms, grid)
+        for name, expr in exprs.items():
+            table[name][i:i + chunk] = expr.evaluate(columns)
+    return table
+
+
+def load_indices(filename, encoding="utf-8"):
+    """
+    read index definitions, one "name = expression" per line, blank lines
+    and lines starting with # are ignored
+    :param filename: config file name
+    :param encoding: file encoding
+    :return: OrderedDict of index name: IndexExpression
+    """
+    indices = OrderedDict()
+    with open(filename, encoding=encoding) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, sep, expr = line.partition("=")
+            name = name.strip()
+            if not sep or not name.isidentifier():
+                raise ValueError("%s:%d: expected 'name = expression'" % (
+                    filename, lineno))
+            if name in indices:
+                raise ValueError("%s:%d: duplicate index %s" % (
+                    filename, lineno, name))
+            try:
+                indices[name] = compile_index(expr.strip())
+            except ValueError as e:
+                raise ValueError("%s:%d: %s" % (filename, lineno, e))
+    return indices
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+多进程批处理
+"""
+import os
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+# item: the input item, result: func(item) or None if failed,
+# error: None or error message of the failed item
+JobResult = namedtuple("JobResult", ["item", "result", "error"])
+
+
+def _safe_call(func, item):
+    """
+    call func on one item, catch the error instead of raising it
+    :param func: job function
+    :param item: job input
+    :return: JobResult
+    """
+    try:
+        return JobResult(item, func(item), None)
+    except Exception as e:
+        return JobResult(item, None, "%s: %s\n%s" % (
+            type(e).__name__, e, traceback.format_exc()))
+
+
+def parallel_map(func, items, workers=None, chunksize=8):
+    """
+    run func on every item in a process pool, results keep the input order,
+    errors are reported per item and do not abort the whole run
+    :param func: job function, must be picklable (module level function or
+                 method of a picklable object)
+    :param items: job inputs, e.g. file names
+    :param workers: max number of worker processes, None for cpu count,
+                    1 to run in the current process
+    :param chunksize: items sent to a worker at once
+    :return: list of JobResult
+    """
+    items = list(items)
+    job = partial(_safe_call, func)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(items)))
+    if workers == 1:
+        return [job(item) for item in items]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(job, items, chunksize=chunksize))
+
+
+def chunks(items, size):
+    """
+    split items into lists of at most size items
+    :param items: input items
+    :param size: chunk size
+    :return: list of chunks
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def list_files(data_dir, filters=None):
+    """
+    list files in a directory, sorted by name
+    :param data_dir: input directory
+    :param filters: file name suffixes to keep, keep all files if None
+    :return: full file names
+    """
+    if not os.path.exists(data_dir) or not os.path.isdir(data_dir):
+        raise OSError("%s is not a dir" % data_dir)
+    files = []
+    for name in sorted(os.listdir(data_dir)):
+        file_ = os.path.join(data_dir, name)
+        if not os.path.isfile(file_):
+            continue
+        if filters is None or name.lower().endswith(tuple(filters)):
+            files.append(file_)
+    return files
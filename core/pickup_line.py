@@ -6,12 +6,19 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 
-from .asd import asd_read, asd_write, asd_write_csv
+from .asd import asd_read, asd_write, asd_write_csv_many
+from .parallel import parallel_map
+from .wavelength import FIELDSPEC
+from .window_stats import WindowStats
+
+# wavelength windows skipped by line choose, [start, end) in nm
+PICKUP_WINDOWS = ((1350, 1500), (1800, 2000), (2300, 2501))
 
 
 class PickUpLine:
     def __init__(self, dirname, resdir=None, threshold=0.02, winsize=100,
-                 group=10, plot=False):
+                 group=10, plot=False, workers=1, windows=PICKUP_WINDOWS,
+                 grid=FIELDSPEC):
         """"
         initial parameters
         :param dirname: asd data located directory
@@ -20,6 +27,11 @@ class PickUpLine:
         :param winsize: the move window size
         :param group: spectral lines of each group, default 10
         :param plot: if True, draw and save the spectral curve
+        :param workers: number of processes to run groups in parallel,
+                        None for cpu count
+        :param windows: [start, end) wavelength windows in nm skipped by
+                        line choose, e.g. PICKUP_WINDOWS or WATER_NM
+        :param grid: wavelength grid of the spectra
         """
         self.dirname = dirname
         self.resdir = resdir
@@ -27,6 +39,13 @@ class PickUpLine:
         self.winsize = winsize
         self.group = group
         self.plot = plot
+        self.workers = workers
+        self.grid = grid
+        self.windows = sorted(grid.band_windows(windows))
+        self.csv_dir = None
+        self.good_dir = None
+        self.good_plot_dir = None
+        self.fail_plot_dir = None
 
     def line_choose(self, data_group):
         """
@@ -34,33 +53,30 @@ class PickUpLine:
         :param data_group: group * data length array
         :return: index of reserve lines
         """
-        data = np.array(data_group)
+        stats = WindowStats(data_group, squares=False)
+        # rows of the spectra still reserved
+        rows = np.arange(len(data_group))
         half_threshold = self.threshold / 2
         result_index = [i for i in range(self.group)]
         i = 0
         while i < self.group:
             j = 0
-            while j < 2151:
+            while j < len(self.grid):
                 if len(result_index) < 4:
                     return []
                 end = j + self.winsize
-                if 1000 <= j < 1150 or 1000 < end < 1150:
-                    j = 1150
-                    continue
-                elif 1450 <= j < 1650 or 1450 < end < 1650:
-                    j = 1650
+                skip = [e for s, e in self.windows if j < e and end > s]
+                if skip:
+                    j = max(skip)
                     continue
-                elif j >= 1950 or end > 1950:
-                    break
-                test_data = data[:, j:end]
-                mean_row = np.mean(test_data, axis=1)
+                mean_row = stats.mean(j, end)[rows]
                 mean_row_std = np.std(mean_row)
-                mean_all = np.mean(test_data)
+                mean_all = np.mean(mean_row)
                 delta = mean_row - mean_all
                 pop_index = np.argmax(np.abs(delta))
                 max_dis = np.max(mean_row) - np.min(mean_row)
                 if max_dis > self.threshold or mean_row_std > half_threshold:
-                    data = np.delete(data, pop_index, 0)
+                    rows = np.delete(rows, pop_index)
                     result_index.pop(int(pop_index))
                     j += self.winsize
                     continue
@@ -92,10 +108,9 @@ class PickUpLine:
             pardir = os.path.abspath(os.path.join(self.dirname, os.pardir))
             self.resdir = os.path.join(pardir, self.dirname + "_result")
         _make_dir(self.resdir)
-        row = len(file_matrix)
         # save csv format data
-        csv_dir = os.path.join(self.resdir, "data_csv")
-        _make_dir(csv_dir)
+        self.csv_dir = os.path.join(self.resdir, "data_csv")
+        _make_dir(self.csv_dir)
         # save binary format data
         bin_dir = os.path.join(self.resdir, "data_binary")
         _make_dir(bin_dir)
@@ -103,67 +118,93 @@ class PickUpLine:
         fail_dir = os.path.join(self.resdir, "data_fail")
         _make_dir(fail_dir)
         # save good data group, binary format
-        good_dir = os.path.join(self.resdir, "data_good")
-        _make_dir(good_dir)
+        self.good_dir = os.path.join(self.resdir, "data_good")
+        _make_dir(self.good_dir)
 
         # save plot image
         plot_dir = os.path.join(self.resdir, "plot")
         _make_dir(plot_dir)
         # save bad data group image
-        fail_plot_dir = os.path.join(plot_dir, "fail")
-        _make_dir(fail_plot_dir)
+        self.fail_plot_dir = os.path.join(plot_dir, "fail")
+        _make_dir(self.fail_plot_dir)
         # save good data group image
-        good_plot_dir = os.path.join(plot_dir, "good")
-        _make_dir(good_plot_dir)
+        self.good_plot_dir = os.path.join(plot_dir, "good")
+        _make_dir(self.good_plot_dir)
+
+        groups = [[os.path.join(self.dirname, name) for name in names]
+                  for names in file_matrix]
+        results = parallel_map(self.process_group, groups,
+                               workers=self.workers, chunksize=1)
 
         # save log
         good = os.path.join(self.resdir, "good.txt")
-        file_log = open(good, "w")
+        mean_names = []
+        mean_data = []
+        with open(good, "w") as file_log:
+            for res in results:
+                if res.error is not None:
+                    print("Failed:[", res.item[0], "-->", res.item[-1], "]",
+                          res.error)
+                    continue
+                good_file, mean = res.result
+                if good_file:
+                    file_log.write(str(good_file) + "\n")
+                    mean_names.append(os.path.basename(res.item[0]))
+                    mean_data.append(mean)
+        # save all good data's mean to one wide csv file
+        if mean_data:
+            asd_write_csv_many(np.array(mean_data),
+                               os.path.join(self.csv_dir, "data_good.csv"),
+                               names=mean_names)
 
-        for i in range(row):
-            group_name = [os.path.join(self.dirname, name)
-                          for name in file_matrix[i]]
-            group_data = []
-            head = None
-            # save good data
-            good_data = []
-            for name in group_name:
-                head, data = asd_read(name)
-                group_data.append(data)
-            # line choose
-            result_index = self.line_choose(group_data)
-            length = len(result_index)
-            print("Processing:[", group_name[i][0], "-->",
-                  group_name[i][-1])
-            if length > 3:
-                good_file = []
-                for j in result_index:
-                    good_file.append(file_matrix[i][j])
-                    good_data.append(group_data[j])
-                file_log.write(str(good_file) + "\n")
-                mean_data = np.mean(good_data, axis=0)
-                # save good data's mean
-                name_ = os.path.join(good_dir, group_name[i][0])
-                asd_write(name_, head, mean_data)
-                asd_write_csv(mean_data, group_name[i][0])
-                plot_name = os.path.join(good_plot_dir, group_name[i][0])
-            else:
-                plot_name = os.path.join(fail_plot_dir, group_name[i][0])
-
-            if self.plot:
-                _plot_data(plot_name, group_data, good_data)
-        file_log.close()
-
-
-def _plot_data(file_name, data_group, good_group):
+    def process_group(self, group_name):
+        """
+        pick up lines of one group and save the mean of the good lines
+        :param group_name: file names of the group
+        :return: good file names and their mean, empty list and None if
+                 the group failed
+        """
+        group_data = []
+        head = None
+        # save good data
+        good_data = []
+        good_file = []
+        mean_data = None
+        for name in group_name:
+            head, data = asd_read(name)
+            group_data.append(data)
+        # line choose
+        result_index = self.line_choose(group_data)
+        length = len(result_index)
+        first = os.path.basename(group_name[0])
+        print("Processing:[", group_name[0], "-->", group_name[-1], "]")
+        if length > 3:
+            for j in result_index:
+                good_file.append(os.path.basename(group_name[j]))
+                good_data.append(group_data[j])
+            mean_data = np.mean(good_data, axis=0)
+            # save good data's mean
+            name_ = os.path.join(self.good_dir, first)
+            asd_write(name_, head, mean_data)
+            plot_name = os.path.join(self.good_plot_dir, first)
+        else:
+            plot_name = os.path.join(self.fail_plot_dir, first)
+
+        if self.plot:
+            _plot_data(plot_name, group_data, good_data, self.grid)
+        return good_file, mean_data
+
+
+def _plot_data(file_name, data_group, good_group, grid=FIELDSPEC):
     """
     plot data
     :param file_name: output image name
     :param data_group: orig group data
     :param good_group: good data
+    :param grid: wavelength grid of the data
     :return: no return
     """
-    x = [i + 350 for i in range(2151)]
+    x = grid.wavelengths
     file_name += ".png"
     if good_group:
         fig = plt.figure(figsize=(32, 18))
@@ -177,7 +218,7 @@ def _plot_data(file_name, data_group, good_group):
         fig = plt.figure(figsize=(16, 9))
         for da in data_group:
             plt.plot(x, da)
-    plt.xlim([350, 2500])
+    plt.xlim([x[0], x[-1]])
     plt.ylim([0, 1])
     plt.savefig(file_name)
     plt.close(fig)
@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+光谱有效数据分段, 在nan间隔处分段处理
+"""
+import numpy as np
+
+
+def finite_runs(finite):
+    """
+    contiguous runs of True values
+    :param finite: 1-D boolean array
+    :return: list of [start, end) runs
+    """
+    edges = np.diff(np.concatenate(([0], np.asarray(finite, np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def segment_layouts(data):
+    """
+    group spectra which have the same layout of finite runs
+    :param data: (N, bands) spectral data
+    :return: dict of finite runs tuple: row indices of the spectra, a slice
+             of all rows if every spectrum has the same layout
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    finite = np.isfinite(data)
+    if len(finite) == 0:
+        return {}
+    packed = np.ascontiguousarray(np.packbits(finite, axis=1))
+    # compare each packed row as one opaque value, much faster than
+    # np.unique(axis=0)
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).reshape(-1)
+    layouts, first, inverse = np.unique(keys, return_index=True,
+                                        return_inverse=True)
+    inverse = inverse.reshape(-1)
+    res = {}
+    for i, row in enumerate(first):
+        runs = tuple(finite_runs(finite[row]))
+        if len(layouts) == 1:
+            res[runs] = slice(None)
+        else:
+            res[runs] = np.flatnonzero(inverse == i)
+    return res
+
+
+def apply_segments(func, data, min_length=1, outputs=None):
+    """
+    run a kernel on every finite segment of the spectra, spectra with the
+    same gap layout are processed together
+    :param func: kernel, takes a (n, length) segment batch and returns an
+                 array of the same shape, or a tuple of arrays if outputs
+                 is given
+    :param data: (N, bands) spectral data, or one spectrum
+    :param min_length: segments shorter than it are copied unchanged
+    :param outputs: number of arrays the kernel returns, None for one array
+    :return: processed data, nan bands stay nan, a tuple of processed data
+             if outputs is given
+    """
+    data = np.asarray(data, dtype=np.float64)
+    count = 1 if outputs is None else outputs
+    out = tuple(np.full(data.shape, np.nan) for i in range(count))
+    out2 = [o.reshape(1, -1) if data.ndim == 1 else o for o in out]
+    data2 = data.reshape(1, -1) if data.ndim == 1 else data
+    for runs, rows in segment_layouts(data2).items():
+        block = data2[rows]
+        for start, end in runs:
+            seg = block[:, start:end]
+            if end - start >= min_length:
+                res = func(seg)
+                res = (res,) if outputs is None else res
+            else:
+                res = (seg,) * count
+            for o, r in zip(out2, res):
+                o[rows, start:end] = r
+    return out[0] if outputs is None else out
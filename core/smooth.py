@@ -1,6 +1,12 @@
 # coding=utf-8
+from functools import lru_cache
+from math import factorial
 import numpy as np
 from scipy.signal import savgol_filter as sg
+from scipy.signal import savgol_coeffs
+
+from .segment import apply_segments
+from .water_remove import water_remove
 
 
 def sg_smooth(data, winsize, order, deriv=0, rate=1):
@@ -9,9 +15,9 @@ def sg_smooth(data, winsize, order, deriv=0, rate=1):
     @param data 数据
     @param winsize 窗口大小, 必须为奇数
     @param order 多项式次数
-    @param deriv 噪声方差
-    @param rate 窗口
-    @return 平滑后的数据
+    @param deriv 导数阶数, 0为平滑
+    @param rate 波段间隔的倒数
+    @return 平滑后的数据或平滑导数
     winsize = np.int(winsize)
     order = np.int(order)
     data = np.array(data)
@@ -35,159 +41,258 @@ def sg_smooth(data, winsize, order, deriv=0, rate=1):
     data = np.concatenate((firstvals, data, lastvals))
 
     return np.convolve(mco[::-1], data, mode='valid')"""
-    return sg(data, winsize, order)
-
-
-def nansg_smooth(data, winsize, order, deriv=0, rate=1):
-    """
-    包含水吸收波段的数据平滑
-    """
-    # 350-1350
-    band1 = data[0:1000]
-    # 1350-1460 水吸收1
-    band2 = data[1000:1110]
-    # 1460 - 1790
-    band3 = data[1110:1450]
-    # 1790 - 1970 水吸收2
-    band4 = data[1450:1620]
-    # 1970 - 2340
-    band5 = data[1620:1989]
-    # 2340 - 2500 水吸收3
-    band6 = data[1989:2151]
-    band1 = sg_smooth(band1, winsize, order, deriv, rate)
-    band2 = sg_smooth(band2, winsize, order, deriv, rate)
-    band3 = sg_smooth(band3, winsize, order, deriv, rate)
-    band4 = sg_smooth(band4, winsize, order, deriv, rate)
-    band5 = sg_smooth(band5, winsize, order, deriv, rate)
-    band6 = sg_smooth(band6, winsize, order, deriv, rate)
-
-    res = np.concatenate((band1, band2, band3, band4, band5, band6))
+    return sg(data, winsize, order, deriv, delta=1 / rate)
+
+
+@lru_cache(maxsize=64)
+def sg_coeffs(winsize, order, deriv=0, rate=1):
+    """
+    savitzky-golay 滤波系数, 按(winsize, order, deriv, rate)缓存
+    @param winsize 窗口大小, 必须为奇数
+    @param order 多项式次数
+    @param deriv 导数阶数
+    @param rate 波段间隔的倒数
+    @return (中间点系数, 左边缘系数矩阵, 右边缘系数矩阵), 中间点与窗口数据
+            点乘, 边缘为窗口多项式拟合值, 与savgol_filter的interp模式一致
+    """
+    if winsize % 2 != 1 or winsize < 1:
+        raise ValueError("winsize必须为奇数且不小于1")
+    if order >= winsize:
+        raise ValueError("winsize过小")
+    half = winsize // 2
+    coeffs = savgol_coeffs(winsize, order, deriv, delta=1 / rate, use="dot")
+    # polynomial fit of the first/last window, evaluated at the edge points
+    x = np.arange(winsize, dtype=np.float64) - half
+    fit = np.linalg.pinv(x[:, None] ** np.arange(order + 1))
+    powers = np.arange(order + 1) - deriv
+    scale = np.array([factorial(p) / factorial(p - deriv) if p >= deriv
+                      else 0 for p in range(order + 1)]) * rate ** deriv
+
+    def evaluate(points):
+        return (scale * points[:, None] ** np.maximum(powers, 0)) @ fit
+
+    left = evaluate(x[:half])
+    right = evaluate(x[winsize - half:])
+    for arr in (coeffs, left, right):
+        arr.flags.writeable = False
+    return coeffs, left, right
+
+
+@lru_cache(maxsize=64)
+def _sg_stack(winsize, order, derivs, rate):
+    """
+    stack the savitzky-golay coefficients of several derivative orders so
+    that they are applied in one pass
+    @return (winsize, k)中间点系数, (k * half, winsize)左右边缘系数矩阵
+    """
+    coeffs = [sg_coeffs(winsize, order, deriv, rate) for deriv in derivs]
+    mid = np.stack([c[0] for c in coeffs], axis=1)
+    left = np.concatenate([c[1] for c in coeffs])
+    right = np.concatenate([c[2] for c in coeffs])
+    return mid, left, right
+
+
+def sg_smooth_batch(data, winsize, order, deriv=0, rate=1, segments=None,
+                    out=None):
+    """
+    批量savitzky-golay平滑, 沿axis=1对每条光谱的每个分段平滑, 可以在同一次
+    卷积中同时计算平滑值与各阶导数
+    @param data (N, bands)光谱数据, 或一条光谱
+    @param winsize 窗口大小, 必须为奇数
+    @param order 多项式次数
+    @param deriv 导数阶数, 0为平滑, 也可以是多个阶数的元组, 如(0, 1)
+    @param rate 波段间隔的倒数
+    @param segments [start, end)分段列表, 默认整条光谱为一段
+    @param out 输出数组, 可以是data本身, deriv为元组时为输出数组的元组
+    @return 平滑后的数据或导数, deriv为元组时返回对应的元组
+    """
+    data = np.asarray(data)
+    single = data.ndim == 1
+    data2 = data.reshape(1, -1) if single else data
+    derivs = tuple(deriv) if isinstance(deriv, (tuple, list)) else (deriv,)
+    if out is None:
+        dtype = np.result_type(data2, np.float32)
+        out = tuple(np.empty(data.shape, dtype=dtype) for d in derivs)
+    elif not isinstance(deriv, (tuple, list)):
+        out = (out,)
+    out2 = [o.reshape(1, -1) if single else o for o in out]
+    if segments is None:
+        segments = [(0, data2.shape[1])]
+    coeffs, left, right = _sg_stack(winsize, order, derivs, rate)
+    half = winsize // 2
+    rows = data2.shape[0]
+    for start, end in segments:
+        seg = data2[:, start:end]
+        if winsize > seg.shape[1]:
+            raise ValueError("winsize过大")
+        windows = np.lib.stride_tricks.sliding_window_view(seg, winsize,
+                                                           axis=1)
+        # compute every output before writing, out may be data itself
+        mid = windows @ coeffs
+        first = (seg[:, :winsize] @ left.T).reshape(rows, len(derivs), half)
+        last = (seg[:, -winsize:] @ right.T).reshape(rows, len(derivs), half)
+        for i, res in enumerate(out2):
+            res[:, start:start + half] = first[:, i]
+            res[:, start + half:end - half] = mid[..., i]
+            res[:, end - half:end] = last[:, i]
+    return tuple(out) if isinstance(deriv, (tuple, list)) else out[0]
+
+
+def nansg_smooth(data, winsize, order, deriv=0, rate=1, windows=None):
+    """
+    包含水吸收波段的数据平滑, data可以是(N, bands)的批量光谱,
+    在nan间隔处自动分段, 短于winsize的分段不做平滑, 其导数为nan
+    @param deriv 导数阶数, 0为平滑, 也可以是多个阶数的元组, 如(0, 1)
+    @param rate 波段间隔的倒数
+    @param windows 如果给定, 先去除这些水吸收波段
+    @return 平滑后的数据或导数, deriv为元组时返回对应的元组
+    """
+    data = _remove_windows(data, windows)
+    multi = isinstance(deriv, (tuple, list))
+    derivs = tuple(deriv) if multi else (deriv,)
+
+    def kernel(seg):
+        if seg.shape[1] < winsize:
+            return tuple(seg if d == 0 else np.full(seg.shape, np.nan)
+                         for d in derivs)
+        return sg_smooth_batch(seg, winsize, order, derivs, rate)
+
+    res = apply_segments(kernel, data, outputs=len(derivs))
+    return res if multi else res[0]
+
 
+def _remove_windows(data, windows):
+    """
+    remove the given water absorb windows before segmented smoothing
+    """
+    if windows is None:
+        return np.asarray(data, dtype=np.float64)
+    return water_remove(data, windows)
+
+
+# 五点三次平滑: 边缘点系数, 中间点卷积核
+_CUBIC5 = (((69, 4, -6, 4, -1), 70),
+           ((2, 27, 12, -8, 2), 35),
+           ((-3, 12, 17, 12, -3), 35))
+# 七点三次平滑: 边缘点系数, 中间点卷积核
+_CUBIC7 = (((39, 8, -4, -4, 1, 4, -2), 42),
+           ((8, 19, 16, 6, -4, -7, 4), 42),
+           ((-4, 16, 19, 12, 2, -4, 1), 42),
+           ((-2, 3, 6, 7, 6, 3, -2), 21))
+
+
+def _cubic_matrix(coeffs, length):
+    """
+    一次三次平滑的线性算子矩阵
+    @param coeffs 边缘点系数与中间点卷积核
+    @param length 光谱长度
+    @return (length, length)矩阵
+    """
+    kernel, div = coeffs[-1]
+    half = len(kernel) // 2
+    if length < len(kernel):
+        raise ValueError("data length must not be less than %d"
+                         % len(kernel))
+    mat = np.zeros((length, length))
+    for i in range(half, length - half):
+        mat[i, i - half:i + half + 1] = np.divide(kernel, div)
+    for i, (row, div) in enumerate(coeffs[:-1]):
+        mat[i, :len(row)] = np.divide(row, div)
+        mat[length - 1 - i, length - len(row):] = np.divide(row[::-1], div)
+    return mat
+
+
+@lru_cache(maxsize=32)
+def _cubic_operator(coeffs, loop, length):
+    """
+    loop次三次平滑的合成算子: loop次卷积核的合成, 以及两端受边缘系数影响的
+    点的系数矩阵
+    @param coeffs 边缘点系数与中间点卷积核
+    @param loop 迭代次数
+    @param length 光谱长度
+    @return (合成卷积核, 左端系数矩阵, 边缘点数), 光谱较短时合成卷积核为None,
+            左端系数矩阵为整个算子
+    """
+    kernel, div = coeffs[-1]
+    half = len(kernel) // 2
+    edge = half * loop
+    # the first edge rows of the loop-th power only depend on the first
+    # size rows of the operator, see the reach of the edge stencils
+    size = 3 * edge + 2 * half + 1
+    if length < 2 * size:
+        mat = np.linalg.matrix_power(_cubic_matrix(coeffs, length), loop)
+        return None, mat, length
+    mat = np.linalg.matrix_power(_cubic_matrix(coeffs, size), loop)
+    composed = np.array([1.0])
+    for i in range(loop):
+        composed = np.convolve(composed, np.divide(kernel, div))
+    for arr in (composed, mat):
+        arr.flags.writeable = False
+    return composed, mat[:edge], edge
+
+
+def _cubic_smooth(data, coeffs, loop):
+    """
+    批量三次平滑
+    @param data (N, bands)光谱数据, 或一条光谱
+    @param coeffs 边缘点系数与中间点卷积核
+    @param loop 迭代次数
+    @return 平滑后的数据
+    """
+    data = np.array(data, dtype=np.float64)
+    if loop < 1:
+        return data
+    length = data.shape[-1]
+    composed, left, edge = _cubic_operator(coeffs, loop, length)
+    if composed is None:
+        return data @ left.T
+    res = np.empty_like(data)
+    size = left.shape[1]
+    res[..., :edge] = data[..., :size] @ left.T
+    res[..., length - edge:] = data[..., length - size:] @ left[::-1, ::-1].T
+    windows = np.lib.stride_tricks.sliding_window_view(data, len(composed),
+                                                       axis=-1)
+    res[..., edge:length - edge] = windows @ composed
     return res
 
 
 def cubic_smooth5(data, loop=1):
     """
     五点三次平滑
-    @param data 光谱数据
+    @param data 光谱数据, 可以是(N, bands)的批量光谱
     @param loop 迭代次数,默认为一次
     @return loop次迭代平滑后的结果
     """
-    length = len(data)
-    data = data.copy()
-    last = length - 2
-    temp = [0 for i in range(length)]
+    return _cubic_smooth(data, _CUBIC5, loop)
 
-    for i in range(loop):
-        temp[0] = (69 * data[0] + 4 * data[1] - 6 * data[2] +
-                   4 * data[3] - data[4]) / 70
-        temp[1] = (2 * data[0] + 27 * data[1] + 12 * data[2] - 8 * data[3] +
-                   2 * data[4]) / 35
-        for j in range(2, last):
-            temp[j] = (-3 * (data[j - 2] + data[j + 2]) + 12 * (data[j - 1] + data[j + 1]) +
-                       17 * data[j]) / 35
-        temp[length - 2] = (2 * data[length - 5] - 8 * data[length - 4] + 12 * data[length - 3] +
-                            27 * data[length - 2] + 2 * data[length - 1]) / 35
-        temp[length - 1] = (-data[length - 5] + 4 * data[length - 4] - 6 * data[length - 3] +
-                            4 * data[length - 2] + 69 * data[length - 1]) / 70
-        data = temp
-
-    return data
-
-
-def nancubic_smooth5(data, loop=1):
-    """
-    包含水吸收波段的数据平滑
-    """
-    # 350-1350
-    band1 = data[0:1000]
-    # 1350-1460 水吸收1
-    band2 = data[1000:1110]
-    # 1460 - 1790
-    band3 = data[1110:1450]
-    # 1790 - 1970 水吸收2
-    band4 = data[1450:1620]
-    # 1970 - 2340
-    band5 = data[1620:1989]
-    # 2340 - 2500 水吸收3
-    band6 = data[1989:2151]
-    band1 = cubic_smooth5(band1, loop)
-    band2 = cubic_smooth5(band2, loop)
-    band3 = cubic_smooth5(band3, loop)
-    band4 = cubic_smooth5(band4, loop)
-    band5 = cubic_smooth5(band5, loop)
-    band6 = cubic_smooth5(band6, loop)
-
-    res = np.concatenate((band1, band2, band3, band4, band5, band6))
 
-    return res
+def nancubic_smooth5(data, loop=1, windows=None):
+    """
+    包含水吸收波段的数据平滑, 在nan间隔处自动分段, 短于5的分段不做平滑
+    @param windows 如果给定, 先去除这些水吸收波段
+    """
+    data = _remove_windows(data, windows)
+
+    return apply_segments(lambda seg: cubic_smooth5(seg, loop), data,
+                          min_length=5)
 
 
 def cubic_smooth7(data, loop=1):
     """
     七点三次平滑
-    @param data 光谱数据
+    @param data 光谱数据, 可以是(N, bands)的批量光谱
     @param loop 迭代次数
     @return loop次迭代平滑后的结果
     """
+    return _cubic_smooth(data, _CUBIC7, loop)
 
-    length = len(data)
-    data = data.copy()
-    last = length - 3
-    temp = [0 for i in range(length)]
 
-    for i in range(loop):
-        temp[0] = (39 * data[0] + 8 * data[1] - 4 * data[2] - 4 * data[3] +
-                   data[4] + 4 * data[5] - 2 * data[6]) / 42
-        temp[1] = (8 * data[0] + 19 * data[1] + 16 * data[2] + 6 * data[3] -
-                   4 * data[4] - 7 * data[5] + 4 * data[6]) / 42
-        temp[3] = (-4 * data[0] + 16 * data[1] + 19 * data[2] + 12 * data[3] +
-                   2 * data[4] - 4 * data[5] + data[6]) / 42
-
-        for j in range(3, last):
-            temp[j] = (-2 * (data[j + 3] + data[j - 3]) + 3 * (data[j - 2] +
-                       data[j + 2]) + 6 * (data[j - 1] + data[j + 1]) +
-                       7 * data[j]) / 21
-        temp[length - 3] = (-4 * data[length - 1] + 16 * data[length - 2] +
-                            19 * data[length - 3] + 12 * data[length - 4] +
-                            2 * data[length - 5] - 4 * data[length - 6] +
-                            data[length - 7]) / 42
-        temp[length - 2] = (8 * data[length - 1] + 19 * data[length - 2] +
-                            16 * data[length - 3] + 6 * data[length - 4] -
-                            4 * data[length - 5] - 7 * data[length - 6] +
-                            4 * data[length - 7]) / 42
-        temp[length - 1] = (39 * data[length - 1] + 8 * data[length - 2] -
-                            4 * data[length - 3] - 4 * data[length - 4] +
-                            data[length - 5] + 4 * data[length - 6] -
-                            2 * data[length - 7]) / 42
-        data = temp
-
-    return data
-
-
-def nancubic_smooth7(data, loop=1):
-    """
-    包含水吸收波段的数据平滑
-    """
-    # 350-1350
-    band1 = data[0:1000]
-    # 1350-1460 水吸收1
-    band2 = data[1000:1110]
-    # 1460 - 1790
-    band3 = data[1110:1450]
-    # 1790 - 1970 水吸收2
-    band4 = data[1450:1620]
-    # 1970 - 2340
-    band5 = data[1620:1989]
-    # 2340 - 2500 水吸收3
-    band6 = data[1989:2151]
-    band1 = cubic_smooth7(band1, loop)
-    band2 = cubic_smooth7(band2, loop)
-    band3 = cubic_smooth7(band3, loop)
-    band4 = cubic_smooth7(band4, loop)
-    band5 = cubic_smooth7(band5, loop)
-    band6 = cubic_smooth7(band6, loop)
-
-    res = np.concatenate((band1, band2, band3, band4, band5, band6))
+def nancubic_smooth7(data, loop=1, windows=None):
+    """
+    包含水吸收波段的数据平滑, 在nan间隔处自动分段, 短于7的分段不做平滑
+    @param windows 如果给定, 先去除这些水吸收波段
+    """
+    data = _remove_windows(data, windows)
 
-    return res
+    return apply_segments(lambda seg: cubic_smooth7(seg, loop), data,
+                          min_length=7)
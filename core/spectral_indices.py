@@ -1,19 +1,36 @@
 # coding=utf-8
 """光谱指数"""
-import statistics
+import numpy as np
 
+from .wavelength import FIELDSPEC
+from .feature_graph import FeatureGraph
+from .window_stats import WindowStats
 
-def ndvi(bands):
+
+def _bands(bands, grid, *nms):
+    """
+    reflection of the bands at the given wavelengths
+    @param bands 高光谱波段数据
+    @param grid 波长网格
+    @param nms 波长(nm)
+    @return 各波长的反射率
+    """
+    return [bands[i] for i in grid.indices(nms)]
+
+
+def ndvi(bands, grid=FIELDSPEC):
     """
     计算NDVI
     公式采用ndvi=(r831-r667)/(r831+r667)
     @param bands 高光谱波段数据
+    @param grid 波长网格, 默认为FieldSpec 350-2500nm
     @return NDVI
     """
-    return (bands[481] - bands[317])/(bands[481] + bands[317])
+    r831, r667 = _bands(bands, grid, 831, 667)
+    return (r831 - r667)/(r831 + r667)
 
 
-def pri(bands):
+def pri(bands, grid=FIELDSPEC):
     """
     计算光化学植被指数(photochemical reflectance index, PRI)
     不同的植被不同的PRI，用于指示光合作用能力、光能利用能力、
@@ -24,10 +41,11 @@ def pri(bands):
     @param bands 高光谱波段数据
     @return PRI
     """
-    return round((bands[181] - bands[220]) / (bands[181] + bands[220]), 6)
+    r531, r570 = _bands(bands, grid, 531, 570)
+    return round((r531 - r570) / (r531 + r570), 6)
 
 
-def gm1(bands):
+def gm1(bands, grid=FIELDSPEC):
     """
     与叶片叶绿素(chlorophyII) 1含量相关. Gitelson A A, Merzlyak M N.
     Remote estimation of chlorophyII content in higher plant leaves.
@@ -36,18 +54,20 @@ def gm1(bands):
     @param 高光谱数据
     @return gm1
     """
-    return round(bands[450] / bands[250], 6)
+    r800, r600 = _bands(bands, grid, 800, 600)
+    return round(r800 / r600, 6)
 
 
-def gm2(bands):
+def gm2(bands, grid=FIELDSPEC):
     """
     叶绿素2含量相关
     gm2 = r750/700
     """
-    return round(bands[450] / bands[400], 6)
+    r800, r750 = _bands(bands, grid, 800, 750)
+    return round(r800 / r750, 6)
 
 
-def lic1(bands):
+def lic1(bands, grid=FIELDSPEC):
     """
     侦测绿色植物叶片的胁迫. Lichtenthaler et al. Detection of vegetation
     stress via a new high resolution fluorescence imaging system. 1996
@@ -55,20 +75,23 @@ def lic1(bands):
     lic2 = r440/r690
     lic3 = r440/r740
     """
-    return (bands[450] - bands[330])/(bands[450] + bands[330])
+    r800, r680 = _bands(bands, grid, 800, 680)
+    return (r800 - r680)/(r800 + r680)
 
 
-def lic2(bands):
+def lic2(bands, grid=FIELDSPEC):
     """lic2"""
-    return round(bands[90] / bands[340], 6)
+    r440, r690 = _bands(bands, grid, 440, 690)
+    return round(r440 / r690, 6)
 
 
-def lic3(bands):
+def lic3(bands, grid=FIELDSPEC):
     """ lic3 """
-    return round(bands[90] / bands[390], 6)
+    r440, r740 = _bands(bands, grid, 440, 740)
+    return round(r440 / r740, 6)
 
 
-def srpi(bands):
+def srpi(bands, grid=FIELDSPEC):
     """
     简单色素比较指数(simple ratio pigment index, SRPI), 该指数基于叶片
     类胡萝卜素和叶绿素含量. Penuelas et al.Semi-imperical indices to
@@ -76,154 +99,172 @@ def srpi(bands):
     reflectance. 1995
     srpi = r430/r680
     """
-    return round(bands[80] / bands[330], 6)
+    r430, r680 = _bands(bands, grid, 430, 680)
+    return round(r430 / r680, 6)
 
 
-def npi(bands):
+def npi(bands, grid=FIELDSPEC):
     """
     归一化脱镁叶绿素指数(Normalized phaepophytiniz index, npi), Barnes et al.
     A reappraisal of the use of DMSO for the extraction and determination of
     chlorophylls a and b in lichens and higher plants. 1992
     npi = (r415-r435)/(r415+r435)
     """
-    return round((bands[65] - bands[85]) / (bands[65] + bands[85]), 6)
+    r415, r435 = _bands(bands, grid, 415, 435)
+    return round((r415 - r435) / (r415 + r435), 6)
 
 
-def npcri(bands):
+def npcri(bands, grid=FIELDSPEC):
     """
     归一化叶绿素比例指数(Normalized pigment chlorophyll ratio index, npcri)
     Penuelas et al. Reflectance indices associated with physiological changes
     in nitrogen- and water-limited sunflower leaves. 1994
     npcri = (r680-r430)/(r680+r430)
     """
-    return round((bands[330] - bands[80]) / (bands[330] + bands[80]), 6)
+    r680, r430 = _bands(bands, grid, 680, 430)
+    return round((r680 - r430) / (r680 + r430), 6)
 
 
-def gi(bands):
+def gi(bands, grid=FIELDSPEC):
     """
     绿度指数(Greenness index, GI).
     gi =  r554/r677
     """
-    return round(bands[204] / bands[327], 6)
+    r554, r677 = _bands(bands, grid, 554, 677)
+    return round(r554 / r677, 6)
 
 
-def sipi(bands):
+def sipi(bands, grid=FIELDSPEC):
     """
     structure intensive pigment index, sipi. Penuelas and Filella. Visible and
     near-infrared reflectance techniques for diagnosing plant physiological
     status.2002
     sipi = (r445-r800)/(r680-r800)
     """
-    return round((bands[95] - bands[450]) / (bands[330] - bands[450]), 6)
+    r445, r800, r680 = _bands(bands, grid, 445, 800, 680)
+    return round((r445 - r800) / (r680 - r800), 6)
 
 
-def sr(bands):
+def sr(bands, grid=FIELDSPEC):
     """
     Simple Ratio, sr. indicator of prolonged vegetation stress due to changes
     in canopy structrue. Gong et al. Analysis of in situ hyperspectral data
     for nutrient estimation of giant sequoia. 2002
     sr = r774/r677
     """
-    return round(bands[424] / bands[327], 6)
+    r774, r677 = _bands(bands, grid, 774, 677)
+    return round(r774 / r677, 6)
 
 
-def wi(bands):
+def wi(bands, grid=FIELDSPEC):
     """
     water index, wi. water status. Penuelas et al. Estimation of plant water
     concentration by the reflectance water index WI(r900/r970). 1997
     wi = r900/r970
     """
-    return round(bands[550] / bands[620], 6)
+    r900, r970 = _bands(bands, grid, 900, 970)
+    return round(r900 / r970, 6)
 
 
-def cai(bands):
+def cai(bands, grid=FIELDSPEC):
     """
     cellulose absorption index, cai. water status. Nagler et al. Cellulose
     absorption index (CAI) to quantify mixed soil-plant litter scenes. 1997
     cai = 0.5*(r2000+r2200)-r2100.
     """
-    return round(0.5*(bands[1650] + bands[1850]) - bands[1750], 6)
+    r2000, r2200, r2100 = _bands(bands, grid, 2000, 2200, 2100)
+    return round(0.5*(r2000 + r2200) - r2100, 6)
 
 
-def msi(bands):
+def msi(bands, grid=FIELDSPEC):
     """
     moisture stress index. water status. Rock et al. Remote detection of forest
     damage. 1986.
     msi = r1600/r820
     """
-    return round(bands[1250] / bands[470], 6)
+    r1600, r820 = _bands(bands, grid, 1600, 820)
+    return round(r1600 / r820, 6)
 
 
-def ndwi(bands):
+def ndwi(bands, grid=FIELDSPEC):
     """
     normalized difference water index, ndwi. water status. Gao et al. NDWI- A
     normalized difference water index for remote sensing of vegetation liquid
     water from space. 1996.
     ndwi = (r860-r1240)/(r860+r1240)
     """
-    return round((bands[510]-bands[690]) / (bands[510]+bands[690]), 6)
+    r860, r1040 = _bands(bands, grid, 860, 1040)
+    return round((r860-r1040) / (r860+r1040), 6)
 
 
-def dwsi(bands):
+def dwsi(bands, grid=FIELDSPEC):
     """
     disease water stress index. dwsi. water status. Galvao et al.
     Discrimination of sugarcane varieties in southeastern Brazil
     with EO-1 hyperion data. 2005
     dwsi = (r802+r547)/(r1657+r682)
     """
-    return round((bands[452] + bands[297]) / (bands[1307]+bands[332]), 6)
+    r802, r647, r1657, r682 = _bands(bands, grid, 802, 647, 1657, 682)
+    return round((r802 + r647) / (r1657+r682), 6)
 
 
-def ratio975(bands):
+def ratio975(bands, grid=FIELDSPEC):
     """
     3-bands ratio at 975. water status. Pu et al. Spectral absorption features
     as indicators of water satus in coast live oak(Quercus agrifolia) leaves.
     2003
     ratio975=2*r960-990/(r920-940 + r1090-1110)
     """
-    temp1 = statistics.mean(bands[610:641])
-    temp2 = statistics.mean(bands[570:591])
-    temp3 = statistics.mean(bands[740:761])
+    stats = WindowStats(bands, grid.window(920, 1110, closed=True,
+                                           strict=True))
+    temp1 = stats.mean(grid.window(960, 990, closed=True, strict=True))
+    temp2 = stats.mean(grid.window(920, 940, closed=True, strict=True))
+    temp3 = stats.mean(grid.window(1090, 1110, closed=True, strict=True))
     return round(2 * temp1 / (temp2 + temp3), 6)
 
 
-def ratio1200(bands):
+def ratio1200(bands, grid=FIELDSPEC):
     """
     ratio1200 = 2*r1180-1200/(r1090-1110 + r1265-1285)
     """
-    temp1 = statistics.mean(bands[830:851])
-    temp2 = statistics.mean(bands[740:761])
-    temp3 = statistics.mean(bands[915:936])
+    stats = WindowStats(bands, grid.window(1090, 1285, closed=True,
+                                           strict=True))
+    temp1 = stats.mean(grid.window(1180, 1200, closed=True, strict=True))
+    temp2 = stats.mean(grid.window(1090, 1110, closed=True, strict=True))
+    temp3 = stats.mean(grid.window(1265, 1285, closed=True, strict=True))
     return round(2 * temp1 / (temp2 + temp3), 6)
 
 
-def lci(bands):
+def lci(bands, grid=FIELDSPEC):
     """
     Leaf Chlorophyll index, lci. Datt. Visible/near infraed reflectance and
     chlorophyll content in eucalyptus leaves. 1999
     lci = (r850-r710)/(r850+r710)
     """
-    return round((bands[500] - bands[360]) / (bands[500] + bands[360]), 6)
+    r850, r710 = _bands(bands, grid, 850, 710)
+    return round((r850 - r710) / (r850 + r710), 6)
 
 
-def sga(bands):
+def sga(bands, grid=FIELDSPEC):
     """
     chlorophyll index. Sims and Gamon. relationships between leaf pigment
     content and spectral reflectance across a wide range of species. 2002
     sga = (r750+r705)/(r750+r705-2*r445)
     """
-    return round((bands[400] + bands[355]) / (bands[400] + bands[355] - 2 * bands[95]), 6)
+    r750, r705, r445 = _bands(bands, grid, 750, 705, 445)
+    return round((r750 + r705) / (r750 + r705 - 2 * r445), 6)
 
 
-def sgb(bands):
+def sgb(bands, grid=FIELDSPEC):
     """
     chlorophyll index.
     sgb = (r750 - r445)/(r705 - r445)
     """
-    return round((bands[400] - bands[95]) / (bands[355] - bands[95]), 6)
+    r750, r445, r705 = _bands(bands, grid, 750, 445, 705)
+    return round((r750 - r445) / (r705 - r445), 6)
 
 
-def wi1180(bands):
+def wi1180(bands, grid=FIELDSPEC):
     """
     water index at 1180nm. Sims and Gamon. Estimation of vegetation water
     content and photosynthetic tissue area from spectral reflectance: a
@@ -231,4 +272,151 @@ def wi1180(bands):
     features. 2003
     wi1180 = r900/r1180
     """
-    return round(bands[550] / bands[830], 6)
+    r900, r1180 = _bands(bands, grid, 900, 1180)
+    return round(r900 / r1180, 6)
+
+
+# 光谱指数的依赖图, 输入节点为data与grid, 中间结果为各波长的反射率列及
+# 波长窗口平均反射率, 被多个指数引用的波段只取一次
+INDICES = FeatureGraph()
+# 指数引用的(起始, 结束)波长窗口
+_WINDOWS = []
+
+
+def _window_stats(data, grid):
+    """
+    prefix sums over the bands covering every index window
+    """
+    start = min(s for s, e in _WINDOWS)
+    end = max(e for s, e in _WINDOWS)
+    # clipped to the grid, each window is checked when it is queried
+    return WindowStats(data, grid.window(start, end, closed=True),
+                       squares=False)
+
+
+INDICES.add("window_stats", ("data", "grid"), _window_stats)
+
+
+def _band_node(nm):
+    """
+    register the reflection column of a wavelength, e.g. r831
+    @param nm 波长(nm)
+    @return 节点名称
+    """
+    name = "r%d" % nm
+    if name not in INDICES.nodes:
+        INDICES.add(name, ("data", "grid"),
+                    lambda data, grid: data[:, grid.index(nm)])
+    return name
+
+
+def _window_node(start, end):
+    """
+    register the mean reflection of a closed wavelength window, e.g.
+    r960_990
+    @param start 起始波长(nm)
+    @param end 结束波长(nm), 包含
+    @return 节点名称
+    """
+    name = "r%d_%d" % (start, end)
+    if name not in INDICES.nodes:
+        _WINDOWS.append((start, end))
+        INDICES.add(name, ("window_stats", "grid"), lambda stats, grid:
+                    stats.mean(grid.window(start, end, closed=True,
+                                           strict=True)))
+    return name
+
+
+def _index_node(name, deps, func, rounded=True):
+    """
+    register an index computed from band columns
+    @param name 指数名称
+    @param deps 波长(nm)或(起始, 结束)波长窗口
+    @param func 以各列为参数计算指数
+    @param rounded 为True时保留6位小数, 与单条光谱的函数一致
+    """
+    deps = [_window_node(*dep) if isinstance(dep, tuple) else _band_node(dep)
+            for dep in deps]
+    if rounded:
+        INDICES.add(name, deps, lambda *cols: np.round(func(*cols), 6))
+    else:
+        INDICES.add(name, deps, func)
+
+
+_index_node("ndvi", (831, 667), lambda r831, r667:
+            (r831 - r667) / (r831 + r667), rounded=False)
+_index_node("pri", (531, 570), lambda r531, r570:
+            (r531 - r570) / (r531 + r570))
+_index_node("gm1", (800, 600), lambda r800, r600: r800 / r600)
+_index_node("gm2", (800, 750), lambda r800, r750: r800 / r750)
+_index_node("lic1", (800, 680), lambda r800, r680:
+            (r800 - r680) / (r800 + r680), rounded=False)
+_index_node("lic2", (440, 690), lambda r440, r690: r440 / r690)
+_index_node("lic3", (440, 740), lambda r440, r740: r440 / r740)
+_index_node("srpi", (430, 680), lambda r430, r680: r430 / r680)
+_index_node("npi", (415, 435), lambda r415, r435:
+            (r415 - r435) / (r415 + r435))
+_index_node("npcri", (680, 430), lambda r680, r430:
+            (r680 - r430) / (r680 + r430))
+_index_node("gi", (554, 677), lambda r554, r677: r554 / r677)
+_index_node("sipi", (445, 800, 680), lambda r445, r800, r680:
+            (r445 - r800) / (r680 - r800))
+_index_node("sr", (774, 677), lambda r774, r677: r774 / r677)
+_index_node("wi", (900, 970), lambda r900, r970: r900 / r970)
+_index_node("cai", (2000, 2200, 2100), lambda r2000, r2200, r2100:
+            0.5 * (r2000 + r2200) - r2100)
+_index_node("msi", (1600, 820), lambda r1600, r820: r1600 / r820)
+_index_node("ndwi", (860, 1040), lambda r860, r1040:
+            (r860 - r1040) / (r860 + r1040))
+_index_node("dwsi", (802, 647, 1657, 682), lambda r802, r647, r1657, r682:
+            (r802 + r647) / (r1657 + r682))
+_index_node("ratio975", ((960, 990), (920, 940), (1090, 1110)),
+            lambda r960_990, r920_940, r1090_1110:
+            2 * r960_990 / (r920_940 + r1090_1110))
+_index_node("ratio1200", ((1180, 1200), (1090, 1110), (1265, 1285)),
+            lambda r1180_1200, r1090_1110, r1265_1285:
+            2 * r1180_1200 / (r1090_1110 + r1265_1285))
+_index_node("lci", (850, 710), lambda r850, r710:
+            (r850 - r710) / (r850 + r710))
+_index_node("sga", (750, 705, 445), lambda r750, r705, r445:
+            (r750 + r705) / (r750 + r705 - 2 * r445))
+_index_node("sgb", (750, 445, 705), lambda r750, r445, r705:
+            (r750 - r445) / (r705 - r445))
+_index_node("wi1180", (900, 1180), lambda r900, r1180: r900 / r1180)
+
+# 全部指数名称, 按定义顺序
+INDEX_NAMES = tuple(name for name in INDICES.nodes
+                    if name != "window_stats" and not name[1].isdigit())
+
+
+def compute_indices(data, names=None, grid=FIELDSPEC, chunk=4096,
+                    return_computed=False):
+    """
+    批量计算光谱指数, 各指数以列运算计算, 被引用的波段对每批光谱只取一次
+    @param data (N, bands)光谱数据, 或一条光谱
+    @param names 需要的指数名称, 默认为INDEX_NAMES中的全部指数
+    @param grid 波长网格
+    @param chunk 每次计算的光谱条数, 限制内存占用
+    @param return_computed 为True时同时返回计算过的节点名称列表
+    @return 以指数名称为字段的结构化数组, 每条光谱一行, 分母为0时为inf或nan
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    if names is None:
+        names = INDEX_NAMES
+    for name in names:
+        if name not in INDEX_NAMES:
+            raise ValueError("unknown index: %s" % name)
+    computed = INDICES.plan(names)
+    table = np.empty(len(data), dtype=[(name, np.float64) for name in names])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(0, len(data), chunk):
+            res, computed = INDICES.compute(
+                names, data=np.asarray(data[i:i + chunk], dtype=np.float64),
+                grid=grid)
+            for name in names:
+                table[name][i:i + chunk] = res[name]
+    if return_computed:
+        return table, computed
+    return table
@@ -0,0 +1,263 @@
+# coding=utf-8
+"""
+光谱数据集文件, 将大量光谱保存在一个文件中
+
+file layout, little endian:
+    file head, 64 bytes: magic, version, rows per block, spectrum count
+    block 0, block 1, ...
+each block holds `block_size` rows, stored as three contiguous sections:
+    names (block_size * 128 bytes), file heads (block_size * 484 bytes),
+    float32 reflection data (block_size * 2151 * 4 bytes)
+"""
+import os
+import struct
+import numpy as np
+
+from .asd import HEAD_SIZE, BANDS, asd_read_many, asd_write_many
+
+MAGIC = b"ASDSTORE"
+VERSION = 1
+NAME_SIZE = 128
+_FILE_HEAD = struct.Struct("<8sIIQ")
+_FILE_HEAD_SIZE = 64
+
+
+class SpectralStore:
+    """
+    single file container of asd spectra, supports append and O(1)
+    random access by row or by name
+    """
+    def __init__(self, filename, mode="r", block_size=1024):
+        """
+        :param filename: container file name
+        :param mode: "r" read only, "a" read and append, create if not
+                     exists, "w" create a new empty container
+        :param block_size: rows per block, only used for new containers
+        """
+        if mode not in ("r", "a", "w"):
+            raise ValueError("mode must be 'r', 'a' or 'w'")
+        self.filename = filename
+        self.mode = mode
+        if mode == "w" or (mode == "a" and not os.path.exists(filename)):
+            with open(filename, "wb") as out:
+                out.write(_FILE_HEAD.pack(MAGIC, VERSION, block_size, 0)
+                          .ljust(_FILE_HEAD_SIZE, b"\0"))
+        elif not os.path.isfile(filename):
+            raise FileNotFoundError("%s not exists or not a file" % filename)
+
+        self._file = open(filename, "rb" if mode == "r" else "r+b")
+        magic, version, self.block_size, self._count = _FILE_HEAD.unpack(
+            self._file.read(_FILE_HEAD.size))
+        if magic != MAGIC or version != VERSION:
+            self._file.close()
+            raise ValueError("%s is not a spectral store file" % filename)
+        self._blocks = []
+        self.names = []
+        self.index = {}
+        for row in range(0, self._count, self.block_size):
+            names = self._block(row // self.block_size)[0]
+            for name in names[:self._count - row]:
+                self._add_name(name.decode("utf-8"))
+
+    @property
+    def _block_bytes(self):
+        return self.block_size * (NAME_SIZE + HEAD_SIZE + BANDS * 4)
+
+    def _block(self, num):
+        """
+        memory map a block
+        :param num: block number
+        :return: names, heads and data arrays of the block
+        """
+        while len(self._blocks) <= num:
+            offset = _FILE_HEAD_SIZE + len(self._blocks) * self._block_bytes
+            mm = np.memmap(self.filename, dtype=np.uint8,
+                           mode="r" if self.mode == "r" else "r+",
+                           offset=offset, shape=(self._block_bytes,))
+            size = self.block_size
+            names = mm[:size * NAME_SIZE].view("S%d" % NAME_SIZE)
+            start = size * NAME_SIZE
+            heads = mm[start:start + size * HEAD_SIZE].reshape(size,
+                                                               HEAD_SIZE)
+            start += size * HEAD_SIZE
+            data = mm[start:].view("<f4").reshape(size, BANDS)
+            self._blocks.append((names, heads, data, mm))
+        return self._blocks[num][:3]
+
+    def _add_name(self, name):
+        if name in self.index:
+            raise ValueError("duplicate spectrum name: %s" % name)
+        self.index[name] = len(self.names)
+        self.names.append(name)
+
+    def _row(self, key):
+        """
+        :param key: row number or spectrum name
+        :return: row number
+        """
+        if isinstance(key, str):
+            return self.index[key]
+        row = int(key)
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError("row %d out of range" % key)
+        return row
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, key):
+        """
+        get one spectrum
+        :param key: row number or spectrum name
+        :return: file head and reflection data
+        """
+        row = self._row(key)
+        names, heads, data = self._block(row // self.block_size)
+        row %= self.block_size
+        return heads[row].tobytes(), np.array(data[row])
+
+    def read(self, keys=None):
+        """
+        read many spectra
+        :param keys: row numbers or spectrum names, all rows if None
+        :return: list of file heads and (N, 2151) reflection data matrix
+        """
+        if keys is None:
+            keys = range(self._count)
+        rows = [self._row(key) for key in keys]
+        heads = []
+        res = np.empty((len(rows), BANDS), dtype=np.float32)
+        for i, row in enumerate(rows):
+            names, head, data = self._block(row // self.block_size)
+            heads.append(head[row % self.block_size].tobytes())
+            res[i] = data[row % self.block_size]
+        return heads, res
+
+    def iter_blocks(self):
+        """
+        iterate over the stored data block by block without copying
+        :return: generator of (names, heads, (n, 2151) data view)
+        """
+        for row in range(0, self._count, self.block_size):
+            count = min(self.block_size, self._count - row)
+            names, heads, data = self._block(row // self.block_size)
+            yield (self.names[row:row + count],
+                   [h.tobytes() for h in heads[:count]], data[:count])
+
+    def extend(self, names, heads, data):
+        """
+        append spectra to the container
+        :param names: spectrum names, must be unique
+        :param heads: file heads
+        :param data: (N, 2151) reflection data
+        :return: no return
+        """
+        if self.mode == "r":
+            raise IOError("%s is opened read only" % self.filename)
+        names = list(names)
+        heads = list(heads)
+        data = np.asarray(data, dtype=np.float32).reshape(-1, BANDS)
+        if not len(names) == len(heads) == len(data):
+            raise ValueError("names, heads and data length not match")
+        seen = set()
+        for name in names:
+            if len(name.encode("utf-8")) > NAME_SIZE:
+                raise ValueError("spectrum name too long: %s" % name)
+            if name in self.index or name in seen:
+                raise ValueError("duplicate spectrum name: %s" % name)
+            seen.add(name)
+
+        total = self._count + len(names)
+        nblocks = -(-total // self.block_size)
+        self._file.truncate(_FILE_HEAD_SIZE + nblocks * self._block_bytes)
+        for i, name in enumerate(names):
+            row = self._count + i
+            block_names, block_heads, block_data = self._block(
+                row // self.block_size)
+            row %= self.block_size
+            block_names[row] = name.encode("utf-8")
+            block_heads[row] = np.frombuffer(bytes(heads[i]), dtype=np.uint8)
+            block_data[row] = data[i]
+            self._add_name(name)
+        for block in self._blocks:
+            block[3].flush()
+        self._count = total
+        self._file.seek(_FILE_HEAD.size - 8)
+        self._file.write(struct.pack("<Q", total))
+        self._file.flush()
+
+    def append(self, name, head, data):
+        """
+        append one spectrum to the container
+        :param name: spectrum name
+        :param head: file head
+        :param data: reflection data
+        :return: no return
+        """
+        self.extend([name], [head], [data])
+
+    def import_files(self, files, chunk=1024):
+        """
+        import asd or reflection files, named by their base name
+        raw asd files are converted to float32 reflection on import, their
+        raw DN data is not preserved in the store
+        :param files: input file names
+        :param chunk: files read per batch
+        :return: no return
+        """
+        files = list(files)
+        for i in range(0, len(files), chunk):
+            part = files[i:i + chunk]
+            heads, data = asd_read_many(part)
+            self.extend([os.path.basename(ff) for ff in part], heads, data)
+
+    def export(self, out_dir, keys=None, chunk=1024):
+        """
+        export spectra to individual reflection files named by their
+        spectrum names, ".ref" is appended if missing, e.g. a spectrum
+        imported from a.asd is exported as a.asd.ref since it holds
+        reflection instead of the raw DN data
+        :param out_dir: output directory
+        :param keys: row numbers or spectrum names, all rows if None
+        :param chunk: spectra written per batch
+        :return: exported file names
+        """
+        if keys is None:
+            keys = range(self._count)
+        rows = [self._row(key) for key in keys]
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        files = []
+        for i in range(0, len(rows), chunk):
+            part = rows[i:i + chunk]
+            heads = []
+            data = np.empty((len(part), BANDS), dtype="<f4")
+            for j, row in enumerate(part):
+                head, data[j] = self.get(row)
+                heads.append(head)
+            files.extend(asd_write_many(
+                [os.path.join(out_dir, self.names[row]) for row in part],
+                heads, data))
+        return files
+
+    def close(self):
+        """
+        close the container file
+        """
+        self._blocks = []
+        if not self._file.closed:
+            self._file.close()
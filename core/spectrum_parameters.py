@@ -4,15 +4,18 @@
 """
 import numpy as np
 from .derivation import derivation1
+from .wavelength import FIELDSPEC
+from .feature_graph import FeatureGraph
+from .window_stats import WindowStats
 from collections import OrderedDict
 
 
-def blue_valley_position(data):
+def blue_valley_position(data, grid=FIELDSPEC):
     """
     蓝谷位置 380~500nm反射率最小值
     """
-    data = data[50:150]
-    return np.nanargmin(data) + 400
+    sl = grid.window(400, 500, strict=True)
+    return grid.wavelengths[sl][np.nanargmin(data[sl])]
 
 
 """def blue_violet_peek_absorb(data):
@@ -23,231 +26,238 @@ def blue_valley_position(data):
     return np.nanargmin(np.array(data[30:150])) + 380"""
 
 
-def blue_edge_amplitude(data):
+def blue_edge_amplitude(data, grid=FIELDSPEC):
     """
     蓝边幅值：蓝波段(490~530nm)一阶微分的最大值
     """
     data = derivation1(data)
-    return round(np.nanmax(data[140:180]), 6)
+    return round(np.nanmax(data[grid.window(490, 530, strict=True)]), 6)
 
 
-def blue_edge_location(data):
+def blue_edge_location(data, grid=FIELDSPEC):
     """
     蓝边位置： 光谱在蓝波段(490~530nm)的拐点、一阶导数的最大值所在位置
     """
     data = derivation1(data)
-    return np.nanargmax(np.array(data[140:180])) + 490
+    sl = grid.window(490, 530, strict=True)
+    return grid.wavelengths[sl][np.nanargmax(data[sl])]
 
 
-def blue_edge_value(data):
+def blue_edge_value(data, grid=FIELDSPEC):
     """
     蓝边反射率
     """
-    loc = blue_edge_location(data)
-    return round(data[loc - 350], 6)
+    loc = blue_edge_location(data, grid)
+    return round(data[grid.index(loc)], 6)
 
 
-def blue_edge_area(data):
+def blue_edge_area(data, grid=FIELDSPEC):
     """
     蓝边面积
     """
     data = derivation1(data)
-    return round(np.nansum(np.abs(data[140:180])), 6)
+    sl = grid.window(490, 530, strict=True)
+    return round(np.nansum(np.abs(data[sl])), 6)
 
 
-def green_peek_value(data):
+def green_peek_value(data, grid=FIELDSPEC):
     """
     绿波段(510~560nm)最大的反射率
     """
-    return round(max(data[160:210]), 6)
+    return round(max(data[grid.window(510, 560, strict=True)]), 6)
 
 
-def green_peek_location(data):
+def green_peek_location(data, grid=FIELDSPEC):
     """
     绿波段(510~560nm)反射峰，即绿峰位置
     """
-    return np.array(data[160:210]).argmax() + 510
+    sl = grid.window(510, 560, strict=True)
+    return grid.wavelengths[sl][np.argmax(data[sl])]
 
 
-def green_peek_area(data):
+def green_peek_area(data, grid=FIELDSPEC):
     """
     绿峰面积：510~560nm原始光谱所围城的面积
     """
-    return round(np.abs(data[160:210]).sum(), 6)
+    return round(np.abs(data[grid.window(510, 560, strict=True)]).sum(), 6)
 
 
-def yellow_edge_amplitude(data):
+def yellow_edge_amplitude(data, grid=FIELDSPEC):
     """
     黄边幅值：在黄波段(560~640nm)一阶微分的最大值
     """
     data = derivation1(data)
-    return round(max(data[210:290]), 6)
+    return round(max(data[grid.window(560, 640, strict=True)]), 6)
 
 
-def yellow_edge_location(data):
+def yellow_edge_location(data, grid=FIELDSPEC):
     """
     黄波段(560~640nm)吸收边即黄边位置：光谱曲线在黄波段的拐点，一阶导数
     在此波段的最大值所在位置
     """
     data = derivation1(data)
-    return np.array(data[210:290]).argmax() + 560
+    sl = grid.window(560, 640, strict=True)
+    return grid.wavelengths[sl][np.argmax(data[sl])]
 
 
-def yellow_edge_value(data):
+def yellow_edge_value(data, grid=FIELDSPEC):
     """
     黄边反射率
     """
-    loc = yellow_edge_location(data)
-    return round(data[loc - 350], 6)
+    loc = yellow_edge_location(data, grid)
+    return round(data[grid.index(loc)], 6)
 
 
-def yellow_edge_area(data):
+def yellow_edge_area(data, grid=FIELDSPEC):
     """
     黄波段(560~640nm)一阶微分的积分
     """
     # 因为光谱间隔为1nm，积分公式为 ΣΔf*Δx，所以只需求和
     data = derivation1(data)
-    return round(np.abs(data[210:290]).sum(), 6)
+    return round(np.abs(data[grid.window(560, 640, strict=True)]).sum(), 6)
 
 
-def red_valley_location(data):
+def red_valley_location(data, grid=FIELDSPEC):
     """
     红波段(650~690nm)吸收峰(红谷):为光谱在红波段的反射率的最小值所在位置
     """
-    return np.array(data[300:340]).argmin() + 650
+    sl = grid.window(650, 690, strict=True)
+    return grid.wavelengths[sl][np.argmin(data[sl])]
 
 
-def red_valley_value(data):
+def red_valley_value(data, grid=FIELDSPEC):
     """
     红谷反射率 光谱在红波段反射率的最小值
     """
-    return round(min(data[300:340]), 6)
+    return round(min(data[grid.window(650, 690, strict=True)]), 6)
 
 
-def red_edge_amplitude(data):
+def red_edge_amplitude(data, grid=FIELDSPEC):
     """
     红边幅值，680~760nm波段一阶微分的最大值
     """
     data = derivation1(data)
-    return round(max(data[330:410]), 6)
+    return round(max(data[grid.window(680, 760, strict=True)]), 6)
 
 
-def red_edge_location(data):
+def red_edge_location(data, grid=FIELDSPEC):
     """
     红边位置:为光谱曲线在红-近红外(680~760nm)波段的拐点，一阶导数的最大值
     """
     data = derivation1(data)
-    return np.array(data[330:410]).argmax() + 680
+    sl = grid.window(680, 760, strict=True)
+    return grid.wavelengths[sl][np.argmax(data[sl])]
 
 
-def red_edge_value(data):
+def red_edge_value(data, grid=FIELDSPEC):
     """
     红边反射率
     """
-    loc = red_edge_location(data)
-    return round(data[loc - 350], 6)
+    loc = red_edge_location(data, grid)
+    return round(data[grid.index(loc)], 6)
 
 
-def red_edge_area(data):
+def red_edge_area(data, grid=FIELDSPEC):
     """
     红边面积：680~760nm一阶微分的积分
     """
     data = derivation1(data)
-    return round(np.abs(data[330:410]).sum(), 6)
+    return round(np.abs(data[grid.window(680, 760, strict=True)]).sum(), 6)
 
 
-def nir_peek_location(data):
+def nir_peek_location(data, grid=FIELDSPEC):
     """
     红外波段(780~950nm)反射率最大值所在位置
     """
-    return np.array(data[430:600]).argmax() + 780
+    sl = grid.window(780, 950, strict=True)
+    return grid.wavelengths[sl][np.argmax(data[sl])]
 
 
-def nir_peek_value(data):
+def nir_peek_value(data, grid=FIELDSPEC):
     """
     红外波段反射率最大值
     """
-    return round(max(data[430:600]), 6)
+    return round(max(data[grid.window(780, 950, strict=True)]), 6)
 
 
-def nir_moisture_sentive_location(data):
+def nir_moisture_sentive_location(data, grid=FIELDSPEC):
     """
     近红外水分(950-1000nm)吸收谷的中心位置
     """
-    data = data[600:650]
-    return np.nanargmax(data) + 950
+    sl = grid.window(950, 1000, strict=True)
+    return grid.wavelengths[sl][np.nanargmax(data[sl])]
 
 
-def swir1_peek_location(data):
+def swir1_peek_location(data, grid=FIELDSPEC):
     """
     短波红外反射率最大值所在位置
     swir1(1100nm-1351nm)
     """
-    data = data[750:1000]
-    return np.nanargmax(data) + 1100
+    sl = grid.window(1100, 1350, strict=True)
+    return grid.wavelengths[sl][np.nanargmax(data[sl])]
 
 
-def swir2_peek_location(data):
+def swir2_peek_location(data, grid=FIELDSPEC):
     """
     短波红外反射率最大值所在位置
     swir1(1400nm-1800nm)
     """
-    data = data[1050:1450]
-    return np.nanargmax(data) + 1400
+    sl = grid.window(1400, 1800, strict=True)
+    return grid.wavelengths[sl][np.nanargmax(data[sl])]
 
 
-def ratio_rg_rr(data):
+def ratio_rg_rr(data, grid=FIELDSPEC):
     """
     绿峰反射率与红谷反射率的比值
     """
-    rg = green_peek_value(data)
-    rr = red_valley_value(data)
+    rg = green_peek_value(data, grid)
+    rr = red_valley_value(data, grid)
 
     return np.divide(rg, rr)
 
 
-def ratio_rg_rr_n(data):
+def ratio_rg_rr_n(data, grid=FIELDSPEC):
     """
     绿峰反射率与红谷反射率的归一化比值
     """
-    rg = green_peek_value(data)
-    rr = red_valley_value(data)
+    rg = green_peek_value(data, grid)
+    rr = red_valley_value(data, grid)
     return np.divide(rg - rr, rg + rr)
 
 
-def ratio_ar_ab(data):
+def ratio_ar_ab(data, grid=FIELDSPEC):
     """
     红边面积与蓝边面积比值
     """
-    ar = red_edge_area(data)
-    ab = blue_edge_area(data)
+    ar = red_edge_area(data, grid)
+    ab = blue_edge_area(data, grid)
     return np.divide(ar, ab)
 
 
-def ratio_ar_ab_n(data):
+def ratio_ar_ab_n(data, grid=FIELDSPEC):
     """
     红边面积与蓝边面积归一化比值
     """
-    ar = red_edge_area(data)
-    ab = blue_edge_area(data)
+    ar = red_edge_area(data, grid)
+    ab = blue_edge_area(data, grid)
     return np.divide(ar - ab, ar + ab)
 
 
-def ratio_ar_ay(data):
+def ratio_ar_ay(data, grid=FIELDSPEC):
     """
     红边面积与黄边面积的比值
     """
-    ar = red_edge_area(data)
-    ay = yellow_edge_area(data)
+    ar = red_edge_area(data, grid)
+    ay = yellow_edge_area(data, grid)
     return np.divide(ar, ay)
 
 
-def ratio_ar_ay_n(data):
+def ratio_ar_ay_n(data, grid=FIELDSPEC):
     """
     红边面积与黄边面积的归一化比值
     """
-    ar = red_edge_area(data)
-    ay = yellow_edge_area(data)
+    ar = red_edge_area(data, grid)
+    ay = yellow_edge_area(data, grid)
     return np.divide(ar - ay, ar + ay)
 
 
@@ -280,3 +290,168 @@ translate = OrderedDict([("blue_valley_position", "蓝谷位置"),
                          ("ratio_ar_ab_n", "红边面积与蓝边面积的归一化比值"),
                          ("ratio_ar_ay", "红边面积与黄边面积的比值"),
                          ("ratio_ar_ay_n", "红边面积与黄边面积的归一化比值")])
+
+
+def extract_parameters(data, names=None, grid=FIELDSPEC, chunk=4096,
+                       return_computed=False):
+    """
+    批量计算光谱参量, 只计算所需参量依赖的中间结果, 每个中间结果(窗口微分等)
+    对每批光谱只计算一次
+    @param data (N, bands)光谱数据, 或一条光谱
+    @param names 需要的参量名称, 默认为translate中的全部参量
+    @param grid 波长网格
+    @param chunk 每次计算的光谱条数, 限制内存占用
+    @param return_computed 为True时同时返回计算过的节点名称列表
+    @return 以参量名称为字段的结构化数组, 每条光谱一行
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    if names is None:
+        names = list(translate)
+    for name in names:
+        if name not in translate:
+            raise ValueError("unknown spectrum parameter: %s" % name)
+    computed = PARAMETERS.plan(names)
+    table = np.empty(len(data), dtype=[(name, np.float64) for name in names])
+    for i in range(0, len(data), chunk):
+        res, computed = PARAMETERS.compute(
+            names, data=np.asarray(data[i:i + chunk], dtype=np.float64),
+            grid=grid)
+        for name in names:
+            table[name][i:i + chunk] = res[name]
+    if return_computed:
+        return table, computed
+    return table
+
+
+def _window_derivation(data, grid, start, end):
+    """
+    一阶微分在波长窗口内的值, 只对窗口及其两侧各一个波段计算
+    """
+    sl = grid.window(start, end, strict=True)
+    lo = max(sl.start - 1, 0)
+    der = derivation1(data[:, lo:sl.stop + 1])
+    return der[:, sl.start - lo:sl.start - lo + sl.stop - sl.start]
+
+
+def _location(data, grid, start, end, func):
+    """
+    窗口内极值所在的波长
+    """
+    sl = grid.window(start, end, strict=True)
+    return grid.wavelengths[sl.start + func(data[:, sl], axis=1)]
+
+
+def _edge_index(derivation, grid, start, end, func):
+    """
+    微分窗口内极值所在的波段索引
+    """
+    sl = grid.window(start, end, strict=True)
+    return sl.start + func(derivation, axis=1)
+
+
+def _edge_value(data, index):
+    """
+    各光谱在给定波段索引处的反射率
+    """
+    return np.round(data[np.arange(len(data)), index], 6)
+
+
+def _abs_stats(data, grid):
+    """
+    反射率绝对值在可见光波段的累加和, 用于计算窗口面积
+    """
+    sl = grid.window(400, 760)
+    return WindowStats(np.abs(data[:, :sl.stop]), sl, squares=False)
+
+
+def _ratio(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.divide(a, b)
+
+
+def _ratio_n(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.divide(a - b, a + b)
+
+
+# 光谱参量及其中间结果的依赖图, 输入节点为data与grid
+PARAMETERS = FeatureGraph()
+_add = PARAMETERS.add
+
+# 中间结果: 窗口一阶微分, 微分极值索引, 窗口反射率
+_add("blue_derivation", ("data", "grid"),
+     lambda data, grid: _window_derivation(data, grid, 490, 530))
+_add("yellow_derivation", ("data", "grid"),
+     lambda data, grid: _window_derivation(data, grid, 560, 640))
+_add("red_derivation", ("data", "grid"),
+     lambda data, grid: _window_derivation(data, grid, 680, 760))
+_add("blue_edge_index", ("blue_derivation", "grid"),
+     lambda der, grid: _edge_index(der, grid, 490, 530, np.nanargmax))
+_add("yellow_edge_index", ("yellow_derivation", "grid"),
+     lambda der, grid: _edge_index(der, grid, 560, 640, np.argmax))
+_add("red_edge_index", ("red_derivation", "grid"),
+     lambda der, grid: _edge_index(der, grid, 680, 760, np.argmax))
+_add("green_window", ("data", "grid"),
+     lambda data, grid: data[:, grid.window(510, 560, strict=True)])
+_add("abs_stats", ("data", "grid"), _abs_stats)
+
+# 蓝谷, 蓝边
+_add("blue_valley_position", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 400, 500, np.nanargmin))
+_add("blue_edge_amplitude", ("blue_derivation",),
+     lambda der: np.round(np.nanmax(der, axis=1), 6))
+_add("blue_edge_location", ("blue_edge_index", "grid"),
+     lambda index, grid: grid.wavelengths[index])
+_add("blue_edge_value", ("data", "blue_edge_index"), _edge_value)
+_add("blue_edge_area", ("blue_derivation",),
+     lambda der: np.round(np.nansum(np.abs(der), axis=1), 6))
+# 绿峰
+_add("green_peek_value", ("green_window",),
+     lambda green: np.round(np.max(green, axis=1), 6))
+_add("green_peek_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 510, 560, np.argmax))
+_add("green_peek_area", ("abs_stats", "grid"),
+     lambda stats, grid: np.round(
+         stats.sum(grid.window(510, 560, strict=True)), 6))
+# 黄边
+_add("yellow_edge_amplitude", ("yellow_derivation",),
+     lambda der: np.round(np.max(der, axis=1), 6))
+_add("yellow_edge_location", ("yellow_edge_index", "grid"),
+     lambda index, grid: grid.wavelengths[index])
+_add("yellow_edge_area", ("yellow_derivation",),
+     lambda der: np.round(np.abs(der).sum(axis=1), 6))
+_add("yellow_edge_value", ("data", "yellow_edge_index"), _edge_value)
+# 红谷, 红边
+_add("red_valley_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 650, 690, np.argmin))
+_add("red_valley_value", ("data", "grid"),
+     lambda data, grid: np.round(
+         np.min(data[:, grid.window(650, 690, strict=True)], axis=1), 6))
+_add("red_edge_amplitude", ("red_derivation",),
+     lambda der: np.round(np.max(der, axis=1), 6))
+_add("red_edge_location", ("red_edge_index", "grid"),
+     lambda index, grid: grid.wavelengths[index])
+_add("red_edge_area", ("red_derivation",),
+     lambda der: np.round(np.abs(der).sum(axis=1), 6))
+_add("red_edge_value", ("data", "red_edge_index"), _edge_value)
+# 近红外, 短波红外
+_add("nir_peek_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 780, 950, np.argmax))
+_add("nir_peek_value", ("data", "grid"),
+     lambda data, grid: np.round(
+         np.max(data[:, grid.window(780, 950, strict=True)], axis=1), 6))
+_add("nir_moisture_sentive_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 950, 1000, np.nanargmax))
+_add("swir1_peek_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 1100, 1350, np.nanargmax))
+_add("swir2_peek_location", ("data", "grid"),
+     lambda data, grid: _location(data, grid, 1400, 1800, np.nanargmax))
+# 比值
+_add("ratio_rg_rr", ("green_peek_value", "red_valley_value"), _ratio)
+_add("ratio_rg_rr_n", ("green_peek_value", "red_valley_value"), _ratio_n)
+_add("ratio_ar_ab", ("red_edge_area", "blue_edge_area"), _ratio)
+_add("ratio_ar_ab_n", ("red_edge_area", "blue_edge_area"), _ratio_n)
+_add("ratio_ar_ay", ("red_edge_area", "yellow_edge_area"), _ratio)
+_add("ratio_ar_ay_n", ("red_edge_area", "yellow_edge_area"), _ratio_n)
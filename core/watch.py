@@ -0,0 +1,135 @@
+# coding=utf-8
+"""
+监视文件夹, 野外采集时增量处理新的光谱文件
+"""
+import os
+import time
+
+from .asd import asd_read
+
+
+class DirWatcher:
+    """
+    poll a directory for new asd files, every new file is read once it is
+    stable, pushed through the processing chain and handed to the sink
+    """
+    def __init__(self, dirname, chain=None, sink=None, filters=(".asd",),
+                 stable=2, skip_existing=False):
+        """
+        :param dirname: directory the spectrometer writes to
+        :param chain: processing functions, each takes and returns the
+                      reflection data, e.g. [water_remove]
+        :param sink: callable(name, head, data) to save the result, e.g.
+                     SpectralStore.append
+        :param filters: file name suffixes to watch
+        :param stable: polls the size and mtime of a file must stay
+                       unchanged before it is read
+        :param skip_existing: if True, ignore files already in the directory
+        """
+        if not os.path.exists(dirname) or not os.path.isdir(dirname):
+            raise OSError("%s is not a dir" % dirname)
+        self.dirname = dirname
+        self.chain = list(chain or [])
+        self.sink = sink
+        self.filters = tuple(filters)
+        self.stable = stable
+        # file name: (size, mtime, unchanged polls) of files not ready yet
+        self.pending = {}
+        # names of processed files
+        self.done = set()
+        # file name: error message of files failed to process
+        self.errors = {}
+        # file name: (size, mtime) of failed files, retried once it changes
+        self.failed = {}
+        if skip_existing:
+            self.done.update(name for name, st in self._scan())
+
+    def _scan(self):
+        """
+        list watched files not processed yet
+        :return: generator of (file name, stat result)
+        """
+        with os.scandir(self.dirname) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in self.done or \
+                   not name.lower().endswith(self.filters):
+                    continue
+                try:
+                    if entry.is_file():
+                        yield name, entry.stat()
+                except OSError:
+                    continue
+
+    def poll(self):
+        """
+        scan the directory once and process files which became stable
+        :return: list of (file name, head, data) processed in this poll
+        """
+        ready = []
+        seen = set()
+        for name, st in self._scan():
+            seen.add(name)
+            key = (st.st_size, st.st_mtime_ns)
+            if self.failed.get(name) == key:
+                continue
+            self.failed.pop(name, None)
+            last = self.pending.get(name)
+            if last is not None and last[:2] == key:
+                count = last[2] + 1
+            else:
+                count = 0
+            if count >= self.stable - 1 and st.st_size > 0:
+                ready.append((name, key))
+            else:
+                self.pending[name] = key + (count,)
+        # forget files deleted from the directory
+        for table in (self.pending, self.failed):
+            for name in [name for name in table if name not in seen]:
+                del table[name]
+
+        results = []
+        for name, key in sorted(ready):
+            self.pending.pop(name, None)
+            try:
+                res = self.process(name)
+            except Exception as e:
+                # retried when the size or mtime of the file changes
+                self.errors[name] = "%s: %s" % (type(e).__name__, e)
+                self.failed[name] = key
+                continue
+            self.done.add(name)
+            self.errors.pop(name, None)
+            results.append(res)
+        return results
+
+    def process(self, name):
+        """
+        read one file, run the processing chain and save it to the sink
+        :param name: file name in the watched directory
+        :return: file name, head and processed data
+        """
+        head, data = asd_read(os.path.join(self.dirname, name))
+        for func in self.chain:
+            data = func(data)
+        if self.sink is not None:
+            self.sink(name, head, data)
+        return name, head, data
+
+    def run(self, interval=1.0, max_polls=None, stop=None):
+        """
+        keep polling the directory
+        :param interval: seconds between two polls
+        :param max_polls: stop after this many polls, None to run forever
+        :param stop: callable, polling stops when it returns True
+        :return: number of processed files
+        """
+        total = 0
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            if stop is not None and stop():
+                break
+            total += len(self.poll())
+            polls += 1
+            time.sleep(interval)
+        return total
@@ -1,29 +1,62 @@
 # coding=utf-8
 import os
-import struct
-from .asd import asd_read
+import time
+from functools import lru_cache
+import numpy as np
+from .asd import (asd_read, asd_read_many, asd_write_many, BANDS,
+                  HEAD_SIZE)
+from .parallel import parallel_map, chunks, list_files
+from .wavelength import FIELDSPEC, WATER_NM
 
+# water absorb bands, [start, end) index of the 350-2500nm data
+# 1349-1460nm, 1800-1970nm, 2339-2500nm
+WATER_BANDS = FIELDSPEC.band_windows(WATER_NM)
 
-def water_remove(data):
+
+@lru_cache(maxsize=32)
+def water_mask(windows=WATER_BANDS, length=BANDS):
+    """
+    boolean mask of water absorb bands
+    :param windows: [start, end) band index of water absorb windows
+    :param length: number of bands
+    :return read only boolean array, True for water absorb bands
+    """
+    mask = np.zeros(length, dtype=bool)
+    for start, end in windows:
+        mask[start:end] = True
+    mask.flags.writeable = False
+    return mask
+
+
+def water_remove(data, windows=WATER_BANDS, inplace=False):
     """
     remove water absorb bands
-    :param data: reflection data
+    :param data: reflection data, one spectrum or (N, bands) array
+    :param windows: [start, end) band index of water absorb windows
+    :param inplace: if True, set nan in data itself, data must be a float
+                    numpy array
     :return data without water absorb bands
     """
     try:
+        # hashable windows for the cached mask, e.g. lists loaded from json
+        windows = tuple((int(start), int(end)) for start, end in windows)
+    except (ValueError, TypeError):
+        raise ValueError("illegal water windows: %r" % (windows,))
+    if inplace:
+        if not isinstance(data, np.ndarray) or data.dtype.kind != "f":
+            raise ValueError("inplace requires a float numpy array")
         res = data
-        # remove water bands
-        # 1350-1460
-        for i in range(999, 1110):
-            res[i] = float("nan")
-        # 1790-1970
-        for i in range(1450, 1620):
-            res[i] = float("nan")
-        # 2340-2500
-        for i in range(1989, 2151):
-            res[i] = float("nan")
-    except ValueError:
+    elif isinstance(data, np.ndarray) and data.dtype.kind == "f":
+        res = data.copy()
+    else:
+        try:
+            res = np.array(data, dtype=np.float64)
+        except (ValueError, TypeError):
+            raise ValueError("illegal data")
+    if res.ndim == 0:
         raise ValueError("illegal data")
+    # remove water bands
+    res[..., water_mask(windows, res.shape[-1])] = np.nan
 
     return res
 
@@ -39,12 +72,17 @@ def water_remove_file(filename):
     return head, water_remove(bands_value)
 
 
-def process_dir(data_dir, result_dir=None):
+def process_dir(data_dir, result_dir=None, windows=WATER_BANDS, workers=None,
+                chunk=256):
     """
     batch processing water remove
     :param data_dir: directory where asd binary file located
     :param result_dir: directory to save processed file results
-    :return no return
+    :param windows: [start, end) band index of water absorb windows
+    :param workers: max number of worker processes, None for cpu count
+    :param chunk: files read, processed and written per job
+    :return processing statistics, dict of written, skipped and failed file
+            counts, errors of failed files, seconds used and files per second
     """
 
     if not os.path.exists(data_dir) or not os.path.isdir(data_dir):
@@ -60,14 +98,71 @@ def process_dir(data_dir, result_dir=None):
     if not os.path.exists(result_dir):
         os.mkdir(result_dir)
 
-    listdir = os.listdir(data_dir)
-
-    for filename in listdir:
-        file_ = os.path.join(data_dir, filename)
-        head, data = asd_read(file_)
-        data = water_remove(data)
-        data = struct.pack("2151b", *data)
-        out_file = os.path.join(result_dir, filename + ".ref")
-        with open(out_file, "wb") as asd_:
-            asd_.write(head)
-            asd_.write(data)
+    begin = time.time()
+    jobs = [(files, result_dir, tuple(windows))
+            for files in chunks(list_files(data_dir), chunk)]
+    stats = {"written": 0, "skipped": 0, "failed": 0, "errors": {}}
+    for res in parallel_map(_process_chunk, jobs, workers=workers,
+                            chunksize=1):
+        if res.error is not None:
+            stats["failed"] += len(res.item[0])
+            stats["errors"].update((ff, res.error) for ff in res.item[0])
+            continue
+        written, skipped, errors = res.result
+        stats["written"] += written
+        stats["skipped"] += skipped
+        stats["failed"] += len(errors)
+        stats["errors"].update(errors)
+    stats["seconds"] = time.time() - begin
+    stats["files_per_second"] = stats["written"] / max(stats["seconds"], 1e-9)
+    print("water remove: %d written, %d skipped, %d failed, %.1f files/s" % (
+        stats["written"], stats["skipped"], stats["failed"],
+        stats["files_per_second"]))
+    return stats
+
+
+def _is_asd(infile):
+    """
+    check if the file is an asd binary file
+    :param infile: input file name
+    :return: True if the file has an asd file header and data section
+    """
+    if os.path.getsize(infile) < HEAD_SIZE + BANDS * 4:
+        return False
+    with open(infile, "rb") as fdata:
+        # reflection files start with "ASD", raw files with "as6", "as7"...
+        return fdata.read(2).lower() == b"as"
+
+
+def _process_chunk(job):
+    """
+    remove water bands of a chunk of files and save them as reflection files
+    :param job: input file names, result directory and water absorb windows
+    :return number of written files, number of skipped files and errors of
+            failed files
+    """
+    files, result_dir, windows = job
+    errors = {}
+    valid = [ff for ff in files if _is_asd(ff)]
+    skipped = len(files) - len(valid)
+    try:
+        heads, data = asd_read_many(valid)
+    except Exception:
+        # read file by file to find the failed ones
+        heads, rows, good = [], [], []
+        for ff in valid:
+            try:
+                head, values = asd_read(ff)
+            except Exception as e:
+                errors[ff] = "%s: %s" % (type(e).__name__, e)
+                continue
+            heads.append(head)
+            rows.append(values)
+            good.append(ff)
+        valid = good
+        data = np.array(rows, dtype=np.float32).reshape(-1, BANDS)
+    water_remove(data, windows, inplace=True)
+    out_files = [os.path.join(result_dir, os.path.basename(ff))
+                 for ff in valid]
+    asd_write_many(out_files, heads, data)
+    return len(valid), skipped, errors
@@ -0,0 +1,149 @@
+# coding=utf-8
+"""
+光谱仪波长网格, 波长(nm)到波段索引的查找表
+"""
+import numpy as np
+
+
+class WavelengthGrid:
+    """
+    band wavelengths of an instrument, with nm -> band index lookup tables
+    built once per grid
+    """
+    def __init__(self, wavelengths, name=None):
+        """
+        :param wavelengths: increasing band wavelengths in nm
+        :param name: grid name
+        """
+        wavelengths = np.array(wavelengths)
+        if wavelengths.ndim != 1 or len(wavelengths) < 2 or \
+           np.any(np.diff(wavelengths) <= 0):
+            raise ValueError("wavelengths must be increasing")
+        wavelengths.flags.writeable = False
+        self.wavelengths = wavelengths
+        self.name = name
+        self._tolerance = np.max(np.diff(wavelengths)) / 2
+        # nearest band of every integer nm in the grid range
+        self._first = int(np.floor(wavelengths[0]))
+        nms = np.arange(self._first, int(np.ceil(wavelengths[-1])) + 1)
+        right = np.clip(np.searchsorted(wavelengths, nms), 1,
+                        len(wavelengths) - 1)
+        left = right - 1
+        nearer_left = nms - wavelengths[left] <= wavelengths[right] - nms
+        self._lut = np.where(nearer_left, left, right)
+        self._windows = {}
+
+    @classmethod
+    def regular(cls, start, stop, step=1, name=None):
+        """
+        grid with a constant band step
+        :param start: first wavelength
+        :param stop: last wavelength, included
+        :param step: band step
+        :param name: grid name
+        :return: WavelengthGrid
+        """
+        count = int(round((stop - start) / step)) + 1
+        if float(step).is_integer() and float(start).is_integer():
+            wavelengths = np.arange(count) * int(step) + int(start)
+        else:
+            wavelengths = np.arange(count) * step + start
+        return cls(wavelengths, name)
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def __repr__(self):
+        return "WavelengthGrid(%s, %g-%gnm, %d bands)" % (
+            self.name, self.wavelengths[0], self.wavelengths[-1], len(self))
+
+    def __eq__(self, other):
+        return isinstance(other, WavelengthGrid) and \
+            np.array_equal(self.wavelengths, other.wavelengths)
+
+    def __hash__(self):
+        return hash(self.wavelengths.tobytes())
+
+    def index(self, nm):
+        """
+        band index of a wavelength
+        :param nm: wavelength in nm
+        :return: index of the nearest band, raise ValueError if the
+                 wavelength is not covered by the grid
+        """
+        if float(nm).is_integer() and \
+           0 <= int(nm) - self._first < len(self._lut):
+            idx = int(self._lut[int(nm) - self._first])
+        else:
+            idx = int(np.clip(np.searchsorted(self.wavelengths, nm), 0,
+                              len(self) - 1))
+            if idx > 0 and nm - self.wavelengths[idx - 1] <= \
+                    self.wavelengths[idx] - nm:
+                idx -= 1
+        if abs(self.wavelengths[idx] - nm) > self._tolerance:
+            raise ValueError("%snm is out of the wavelength grid %r" % (
+                nm, self))
+        return idx
+
+    def indices(self, nms):
+        """
+        band indices of wavelengths
+        :param nms: wavelengths in nm
+        :return: index array
+        """
+        return np.array([self.index(nm) for nm in nms], dtype=np.intp)
+
+    def window(self, start, end, closed=False, strict=False):
+        """
+        band slice of a wavelength window
+        :param start: start wavelength, included
+        :param end: end wavelength, excluded unless closed is True
+        :param closed: if True, include the end wavelength
+        :param strict: if True, raise ValueError when the window is not
+                       covered by the grid, else the slice is clipped to the
+                       grid and may be empty
+        :return: slice of band index
+        """
+        if strict:
+            lo = self.wavelengths[0] - self._tolerance
+            hi = self.wavelengths[-1] + self._tolerance
+            # an open end may lie one band past the grid
+            if not closed:
+                hi += 2 * self._tolerance
+            if start < lo or end > hi or end <= start:
+                raise ValueError("%s-%snm window is not covered by %r" % (
+                    start, end, self))
+        key = (start, end, closed)
+        if key not in self._windows:
+            side = "right" if closed else "left"
+            self._windows[key] = slice(
+                int(np.searchsorted(self.wavelengths, start, "left")),
+                int(np.searchsorted(self.wavelengths, end, side)))
+        return self._windows[key]
+
+    def band_windows(self, windows):
+        """
+        convert wavelength windows to band index windows
+        :param windows: [start, end) wavelength windows in nm
+        :return: tuple of [start, end) band index windows
+        """
+        res = []
+        for start, end in windows:
+            sl = self.window(start, end)
+            res.append((sl.start, sl.stop))
+        return tuple(res)
+
+
+# ASD FieldSpec 3/4, 350-2500nm at 1nm
+FIELDSPEC = WavelengthGrid.regular(350, 2500, 1, "FieldSpec")
+# ASD FieldSpec HandHeld 2, 325-1075nm at 1nm
+HANDHELD = WavelengthGrid.regular(325, 1075, 1, "HandHeld")
+
+GRIDS = {
+    "fieldspec3": FIELDSPEC,
+    "fieldspec4": FIELDSPEC,
+    "handheld": HANDHELD,
+}
+
+# water absorb windows in nm, [start, end)
+WATER_NM = ((1349, 1460), (1800, 1970), (2339, 2501))
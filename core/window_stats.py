@@ -0,0 +1,130 @@
+# coding=utf-8
+"""
+波段窗口统计量, 由沿波段方向的累加和计算任意窗口的和, 均值与标准差
+"""
+import numpy as np
+
+
+class WindowStats:
+    """
+    prefix sums of a batch of spectra along the band axis, built once, the
+    sum, mean and std of any band window then cost O(1) per spectrum
+    """
+    def __init__(self, data, span=None, squares=True):
+        """
+        :param data: (N, bands) spectral data, or one spectrum
+        :param span: slice of the bands covered, windows must lie inside it,
+                     None for all bands
+        :param squares: if False, do not build the sums of squares, std is
+                        not available
+        """
+        data = np.asarray(data, dtype=np.float64)
+        self.single = data.ndim == 1
+        if self.single:
+            data = data.reshape(1, -1)
+        span = slice(None) if span is None else span
+        self.start, self.stop, _ = span.indices(data.shape[1])
+        data = data[:, self.start:self.stop]
+        nan = np.isnan(data)
+        # nan counts are only kept when there is a nan band
+        self._nan = None
+        if nan.any():
+            self._nan = self._prefix(nan)
+            data = np.where(nan, 0, data)
+        self._sum = self._prefix(data)
+        self._sq = self._prefix(data * data) if squares else None
+
+    @staticmethod
+    def _prefix(values):
+        """
+        cumulative sums with a leading zero column
+        """
+        res = np.zeros((values.shape[0], values.shape[1] + 1),
+                       dtype=np.int64 if values.dtype == bool else np.float64)
+        np.cumsum(values, axis=1, out=res[:, 1:])
+        return res
+
+    def _bounds(self, start, stop):
+        """
+        :param start: first band index, or a slice of band index
+        :param stop: end band index, excluded
+        :return: start and stop relative to the covered span
+        """
+        if isinstance(start, slice):
+            start, stop = start.start, start.stop
+        start = np.clip(np.asarray(start) - self.start, 0,
+                        self.stop - self.start)
+        stop = np.clip(np.asarray(stop) - self.start, start,
+                       self.stop - self.start)
+        return start, stop
+
+    def _window(self, prefix, start, stop):
+        res = prefix[:, stop] - prefix[:, start]
+        return res[0] if self.single else res
+
+    def count(self, start, stop=None, skipna=True):
+        """
+        number of bands in the windows
+        :param start: first band index, a slice, or an index array for
+                      several windows
+        :param stop: end band index, excluded
+        :param skipna: if True, count the finite bands only
+        :return: count of every spectrum (and window)
+        """
+        start, stop = self._bounds(start, stop)
+        width = np.broadcast_to(stop - start, (1,) + np.shape(start))
+        if skipna and self._nan is not None:
+            width = width - self._nan[:, stop] + self._nan[:, start]
+        else:
+            width = np.broadcast_to(width, (len(self._sum),) + width.shape[1:])
+        return width[0] if self.single else width
+
+    def sum(self, start, stop=None, skipna=False):
+        """
+        sum of the windows
+        :param start: first band index, a slice, or an index array for
+                      several windows
+        :param stop: end band index, excluded
+        :param skipna: if True, nan bands are ignored, else the sum of a
+                       window with nan is nan
+        :return: sum of every spectrum (and window)
+        """
+        start, stop = self._bounds(start, stop)
+        res = self._window(self._sum, start, stop)
+        if not skipna and self._nan is not None:
+            res = np.where(self._window(self._nan, start, stop) > 0,
+                           np.nan, res)
+        return res
+
+    def mean(self, start, stop=None, skipna=False):
+        """
+        mean of the windows
+        :param start: first band index, a slice, or an index array for
+                      several windows
+        :param stop: end band index, excluded
+        :param skipna: if True, nan bands are ignored
+        :return: mean of every spectrum (and window), nan for empty windows
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sum(start, stop, skipna) / \
+                self.count(start, stop, skipna)
+
+    def std(self, start, stop=None, skipna=False, ddof=0):
+        """
+        standard deviation of the windows
+        :param start: first band index, a slice, or an index array for
+                      several windows
+        :param stop: end band index, excluded
+        :param skipna: if True, nan bands are ignored
+        :param ddof: delta degrees of freedom
+        :return: std of every spectrum (and window)
+        """
+        if self._sq is None:
+            raise ValueError("WindowStats built without squares")
+        count = self.count(start, stop, skipna)
+        mean = self.mean(start, stop, skipna)
+        b0, b1 = self._bounds(start, stop)
+        sq = self._window(self._sq, b0, b1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = (sq - count * mean * mean) / (count - ddof)
+        return np.sqrt(np.maximum(var, 0))
@@ -6,8 +6,8 @@ from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QColor
 
 from .color import cnames
-from .global_path import setdir
-from ..core.asd import asd_read
+from .global_path import setdir, cachefile
+from ..core.cache import SpectrumCache
 
 
 class FileListWidget(QListWidget):
@@ -28,6 +28,7 @@ class FileListWidget(QListWidget):
         # self.itemSelectionChanged.connect(self.selected_items)
         # self.itemChanged()
         self.colors = cycle(cnames)
+        self.cache = None
 
     def add_files(self, files):
         """
@@ -44,25 +45,46 @@ class FileListWidget(QListWidget):
         # set global path to current dir
         dir_name = os.path.dirname(files[0])
         setdir(dir_name)
+        new_files = []
+        seen = set()
         for ff in files:
             if not os.path.exists(ff):
                 continue
             dot = ff.rfind(".")
             ends = ff[dot:]
             if ends in self.filters:
-                if self.findItems(ff, Qt.MatchExactly):
+                if ff in seen or self.findItems(ff, Qt.MatchExactly):
                     continue
-                self.add_item(ff)
+                seen.add(ff)
+                new_files.append(ff)
+        if not new_files:
+            return
+        # decode all files through the cache in one batch
+        heads, data = self._get_cache().read_many(new_files)
+        for ff, head, values in zip(new_files, heads, data):
+            self.add_item(ff, (head, values))
 
-    def add_item(self, file_name):
+    def _get_cache(self):
+        """
+        open the spectrum cache on first use
+        """
+        if self.cache is None:
+            self.cache = SpectrumCache(cachefile)
+        return self.cache
+
+    def add_item(self, file_name, spectrum=None):
         """
         add single file to item list
         :param file_name: input file name
+        :param spectrum: decoded (head, data) of the file, read through the
+                         cache if None
         :return: no return
         """
         item = FileListItem()
         base_name = os.path.basename(file_name)
-        head, data = asd_read(file_name)
+        if spectrum is None:
+            spectrum = self._get_cache().read(file_name)
+        head, data = spectrum
         item.setData(Qt.DisplayRole, base_name)
         item.setData(Qt.UserRole, (head, data))
         item.setData(Qt.CheckStateRole, Qt.Unchecked)
@@ -6,6 +6,8 @@ import os
 curdir = os.path.expanduser("~")
 resource = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 icondir = os.path.join(resource, "icons")
+cachefile = os.path.join(os.path.expanduser("~"), ".asdprocess",
+                         "cache.sqlite")
 asdtype = "ASD Reflectance Files(*.ref; *.mn);;ASD Indico Files(*.asd)"
 
 
@@ -1,4 +1,5 @@
 # coding=utf-8
+import os
 import numpy as np
 import pandas as pd
 from sklearn import preprocessing
@@ -43,32 +44,162 @@ def relate_calculate(specfile, biofile, savefile):
 def correlation(spec, bio):
     """
     计算相关系数
-    spec为光谱数据
-    bio为相应的生化参数
+    spec为光谱数据, (波段数, 样本数)
+    bio为相应的生化参数, (参数个数, 样本数)
+    返回(波段数, 参数个数)的相关系数矩阵
     """
-    spec = np.array(spec)
-    bio = np.array(bio)
+    spec = np.array(spec, dtype=np.float64)
+    bio = np.array(bio, dtype=np.float64)
     if bio.shape[1] != spec.shape[1]:
         print("输入数据无效, 样本数不一致。")
         return None
-    # 获取bio行数
-    cols = bio.shape[0]
-    # 获取spec行数
-    rows = spec.shape[0]
-    res = [[] for col in range(cols)]
-    for col in range(cols):
-        biomean = np.mean(bio[col])
-        biodelta = bio[col] - biomean
-        biodeltasq = np.sum(np.multiply(biodelta, biodelta)) ** 0.5
-        for row in range(rows):
-            bandmean = np.mean(spec[row])
-            banddelta = spec[row] - bandmean
-            banddeltasq = np.sum(np.multiply(banddelta, banddelta)) ** 0.5
-            deltam = np.sum(np.multiply(biodelta, banddelta))
-            rel = np.divide(deltam, banddeltasq * biodeltasq)
-            res[col].append(rel)
-    res = np.array(res).T
-    return res
+    specdelta = spec - spec.mean(axis=1, keepdims=True)
+    biodelta = bio - bio.mean(axis=1, keepdims=True)
+    specdeltasq = np.sqrt(np.einsum("ij,ij->i", specdelta, specdelta))
+    biodeltasq = np.sqrt(np.einsum("ij,ij->i", biodelta, biodelta))
+    deltam = specdelta @ biodelta.T
+    return np.divide(deltam, np.outer(specdeltasq, biodeltasq))
+
+
+def _pair_values(left, right, kind):
+    """
+    两组波段所有组合的指数值
+    left为(m, 样本数), right为(n, 样本数)
+    kind为"ndsi"时计算(Ri-Rj)/(Ri+Rj), 为"sr"时计算Ri/Rj
+    返回(m, n, 样本数)
+    """
+    left = left[:, None, :]
+    right = right[None, :, :]
+    if kind == "ndsi":
+        return (left - right) / (left + right)
+    return left / right
+
+
+def _pair_r(values, biodelta, biodeltasq):
+    """
+    各波段组合的指数值与生化参数的相关系数
+    values为(m, n, 样本数), biodelta为去均值后的生化参数
+    """
+    values -= values.mean(axis=2, keepdims=True)
+    deltasq = np.sqrt(np.einsum("ijk,ijk->ij", values, values))
+    return (values @ biodelta) / (deltasq * biodeltasq)
+
+
+def band_pair_correlation(spec, bio, kind="ndsi", top=10, mapfile=None,
+                          wavelengths=None, max_bytes=64 * 1024 ** 2):
+    """
+    穷举所有波段组合(i, j)的归一化差值指数(ndsi)或比值指数(sr),
+    计算其与一个生化参数的相关系数
+    spec为光谱数据, (波段数, 样本数), 与correlation相同
+    bio为一个生化参数, (样本数, )
+    kind为"ndsi"或"sr", ndsi的r²关于对角线对称, 只计算上三角分块后镜像
+    top为保留相关系数平方最大的组合个数
+    mapfile为r²图的保存文件(.npy), 以内存映射方式写入, 为None时不保存
+    wavelengths为各波段的波长, 默认为波段序号
+    max_bytes为每个分块的最大内存占用
+    返回(前top个组合的结构化数组, r²图), 组合按r²从大到小排列,
+    r²图为(波段数, 波段数)的float32数组, 分母为0等无效组合为nan
+    """
+    if kind not in ("ndsi", "sr"):
+        raise ValueError("kind must be ndsi or sr")
+    spec = np.asarray(spec, dtype=np.float64)
+    bio = np.asarray(bio, dtype=np.float64).reshape(-1)
+    bands, samples = spec.shape
+    if len(bio) != samples:
+        raise ValueError("输入数据无效, 样本数不一致。")
+    if wavelengths is None:
+        wavelengths = np.arange(bands)
+    wavelengths = np.asarray(wavelengths)
+    biodelta = bio - bio.mean()
+    biodeltasq = np.sqrt(np.dot(biodelta, biodelta))
+    if mapfile is None:
+        r2map = np.empty((bands, bands), dtype=np.float32)
+    else:
+        r2map = np.lib.format.open_memmap(mapfile, mode="w+",
+                                          dtype=np.float32,
+                                          shape=(bands, bands))
+    tile = max(1, int((max_bytes / (8 * samples)) ** 0.5))
+    # 当前最好的top个组合的r², r, i, j
+    best = (np.empty(0), np.empty(0), np.empty(0, np.intp),
+            np.empty(0, np.intp))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i0 in range(0, bands, tile):
+            i1 = min(i0 + tile, bands)
+            start = i0 if kind == "ndsi" else 0
+            for j0 in range(start, bands, tile):
+                j1 = min(j0 + tile, bands)
+                r = _pair_r(_pair_values(spec[i0:i1], spec[j0:j1], kind),
+                            biodelta, biodeltasq)
+                r2 = r * r
+                r2map[i0:i1, j0:j1] = r2
+                if kind == "ndsi" and j0 != i0:
+                    r2map[j0:j1, i0:i1] = r2.T
+                # ndsi只取i<j的组合, sr取i!=j的组合
+                ii, jj = np.ogrid[i0:i1, j0:j1]
+                valid = ii < jj if kind == "ndsi" else ii != jj
+                score = np.where(valid & np.isfinite(r2), r2, -np.inf)
+                best = _merge_top(best, score.ravel(), r.ravel(),
+                                  i0, j0, j1 - j0, top)
+    if mapfile is not None:
+        r2map.flush()
+
+    r2, r, ii, jj = best
+    keep = np.isfinite(r2)
+    res = np.empty(np.count_nonzero(keep), dtype=[
+        ("i", np.intp), ("j", np.intp), ("wavelength_i", wavelengths.dtype),
+        ("wavelength_j", wavelengths.dtype), ("r", np.float64),
+        ("r2", np.float64)])
+    res["i"], res["j"] = ii[keep], jj[keep]
+    res["wavelength_i"] = wavelengths[ii[keep]]
+    res["wavelength_j"] = wavelengths[jj[keep]]
+    res["r"], res["r2"] = r[keep], r2[keep]
+    return res, r2map
+
+
+def _merge_top(best, score, r, i0, j0, width, top):
+    """
+    把一个分块中r²最大的组合并入当前最好的top个组合
+    """
+    if len(score) > top:
+        idx = np.argpartition(score, -top)[-top:]
+    else:
+        idx = np.arange(len(score))
+    r2 = np.concatenate((best[0], score[idx]))
+    rr = np.concatenate((best[1], r[idx]))
+    ii = np.concatenate((best[2], i0 + idx // width))
+    jj = np.concatenate((best[3], j0 + idx % width))
+    order = np.argsort(-r2, kind="stable")[:top]
+    return r2[order], rr[order], ii[order], jj[order]
+
+
+def band_pair_calculate(specfile, biofile, savedir, kind="ndsi", top=20):
+    """
+    对biofile中的每个生化参数穷举波段组合, 文件格式与relate_calculate相同
+    每个参数保存两个文件:
+    参数名_kind.npy, (波段数, 波段数)的r²图
+    参数名_kind_top.csv, r²最大的top个波段组合
+    """
+    try:
+        specdata = pd.read_csv(specfile, index_col=0)
+        biodata = pd.read_csv(biofile, index_col=0)
+    except Exception as e:
+        print("band_pair_calculate: %s" % e)
+        return False
+
+    try:
+        os.makedirs(savedir, exist_ok=True)
+        for name, bio in zip(biodata.index, biodata.values):
+            base = os.path.join(savedir, "%s_%s" % (name, kind))
+            res, r2map = band_pair_correlation(
+                specdata.values, bio, kind=kind, top=top,
+                mapfile=base + ".npy", wavelengths=specdata.index.values)
+            del r2map
+            pd.DataFrame(res).to_csv(base + "_top.csv", index=False)
+    except Exception as e:
+        print("band_pair_calculate: %s" % e)
+        return False
+    return True
 
 
 class PCA: